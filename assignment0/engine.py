@@ -0,0 +1,217 @@
+import math
+
+import numpy as np
+from pygame.math import Vector2
+
+from common.vectors import BLOCK_ELEMENTS, normalize_rows
+
+
+class FlockEngine:
+    def __init__(self, pos: np.ndarray, move: np.ndarray, width: int, height: int, velocity: float):
+        self.pos = np.asarray(pos, dtype=np.float64)
+        self.move = np.asarray(move, dtype=np.float64)
+        self.direction = normalize_rows(self.move)
+        self.width = width
+        self.height = height
+        self.velocity = velocity
+
+    @classmethod
+    def from_agents(cls, agents, width: int, height: int, velocity: float, **options) -> 'FlockEngine':
+        # `options` go to the constructor, e.g. GridFlockEngine's resolution
+        pos = np.array([[agent.pos.x, agent.pos.y] for agent in agents], dtype=np.float64).reshape(-1, 2)
+        move = np.array([[agent.move.x, agent.move.y] for agent in agents], dtype=np.float64).reshape(-1, 2)
+        return cls(pos, move, width, height, velocity, **options)
+
+    def __len__(self) -> int:
+        return len(self.pos)
+
+    def wrap(self):
+        # Pac-man-style teleport, same order of checks as Agent.there_is_no_escape
+        x, y = self.pos[:, 0], self.pos[:, 1]
+        x[x < 0] = self.width
+        x[x > self.width] = 0
+        y[y < 0] = self.height
+        y[y > self.height] = 0
+
+    def exact_sums(self, rows: np.ndarray, radius: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Number of neighbours, sum of their positions and sum of their directions for the given birds
+        n = len(rows)
+        counts = np.zeros(n, dtype=np.float64)
+        pos_sums = np.zeros((n, 2), dtype=np.float64)
+        dir_sums = np.zeros((n, 2), dtype=np.float64)
+
+        block = max(1, BLOCK_ELEMENTS // max(len(self.pos), 1))
+        for start in range(0, n, block):
+            stop = min(start + block, n)
+            chunk = rows[start:stop]
+            diff = self.pos[chunk, None, :] - self.pos[None, :, :]
+            in_range = np.einsum('ijk,ijk->ij', diff, diff) <= radius * radius
+            # A bird is never its own neighbour
+            in_range[np.arange(stop - start), chunk] = False
+
+            weights = in_range.astype(np.float64)
+            counts[start:stop] = weights.sum(axis=1)
+            pos_sums[start:stop] = weights @ self.pos
+            dir_sums[start:stop] = weights @ self.direction
+
+        return counts, pos_sums, dir_sums
+
+    def neighbour_sums(self, radius: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        return self.exact_sums(np.arange(len(self.pos)), radius)
+
+    def steering(self, rows, counts: np.ndarray, pos_sums: np.ndarray, dir_sums: np.ndarray,
+                 weights: tuple[float, float, float]) -> np.ndarray:
+        # New move vectors for the given birds (all of them with rows=slice(None))
+        alignment_weight, cohesion_weight, separation_weight = weights
+        direction = self.direction[rows]
+        pos = self.pos[rows]
+
+        has_neighbors = counts > 0
+        k = np.where(has_neighbors, counts, 1)[:, None]
+
+        # Bird includes its own direction in the alignment sum, like Bird.change_position
+        avg_dir = normalize_rows((direction + dir_sums) / k)
+        avg_separation_dir = normalize_rows((k * pos - pos_sums) / k)
+        cohesion = pos_sums / k - pos - direction
+
+        move = normalize_rows(
+            direction
+            + alignment_weight * avg_dir
+            + separation_weight * avg_separation_dir
+            + cohesion_weight * cohesion
+        )
+        return np.where(has_neighbors[:, None], move, self.move[rows])
+
+    def steer(self, counts: np.ndarray, pos_sums: np.ndarray, dir_sums: np.ndarray,
+              weights: tuple[float, float, float]):
+        self.move = self.steering(slice(None), counts, pos_sums, dir_sums, weights)
+
+    def step(self, radius: float, weights: tuple[float, float, float]):
+        self.wrap()
+        self.direction = normalize_rows(self.move)
+
+        counts, pos_sums, dir_sums = self.neighbour_sums(radius)
+        self.steer(counts, pos_sums, dir_sums, weights)
+
+        self.pos += self.move * self.velocity
+
+    def write_back(self, agents):
+        # Mirror the arrays onto the sprites so they can be drawn and recorded
+        for agent, pos, move, direction in zip(agents, self.pos, self.move, self.direction):
+            agent.pos = Vector2(pos[0], pos[1])
+            agent.move = Vector2(move[0], move[1])
+            agent.direction = Vector2(direction[0], direction[1])
+
+
+# Number of cells per radius for GridFlockEngine. Mean steering error and step time measured on uniformly spread
+# flocks (radius 75, 750x750 window):
+#   resolution 2:  12.5 deg (300 birds), 16.6 deg (5k birds), 15.9 s per step at 100k birds
+#   resolution 4:   9.5 deg, 13.6 deg, 4.2 s
+#   resolution 8:   6.3 deg, 10.4 deg, 1.1 s
+#   resolution 16:  4.1 deg,  7.0 deg, 0.44 s, but the far cells cost ~0.12 s per step even for 300 birds
+GRID_RESOLUTION = 8
+
+
+class GridFlockEngine(FlockEngine):
+    # Approximate rules for very big flocks. Birds in the 3x3 cells around a bird are still checked pair by pair
+    # (that's where separation matters), cells further away only add their totals (count, position and direction
+    # sums), cells on the edge of the radius count partly.
+    # `resolution` is the number of cells per radius. At 1 every neighbour is in the 3x3 cells, so it's exact
+    # (and slow). From 2 up the error shrinks as the resolution grows, see steering_error and GRID_RESOLUTION
+    def __init__(self, pos: np.ndarray, move: np.ndarray, width: int, height: int, velocity: float,
+                 resolution: int = GRID_RESOLUTION):
+        super().__init__(pos, move, width, height, velocity)
+        if resolution < 1:
+            raise ValueError(f"Grid resolution must be at least 1 cell per radius, got {resolution}")
+        self.resolution = resolution
+
+    def _cells(self, cell_size: float) -> tuple[np.ndarray, np.ndarray, int, int]:
+        cols = int(self.width // cell_size) + 1
+        rows = int(self.height // cell_size) + 1
+        cx = np.clip((self.pos[:, 0] // cell_size).astype(np.int64), 0, cols - 1)
+        cy = np.clip((self.pos[:, 1] // cell_size).astype(np.int64), 0, rows - 1)
+        return cx, cy, cols, rows
+
+    def far_sums(self, cx: np.ndarray, cy: np.ndarray, cols: int, rows: int, cell_size: float, radius: float):
+        # Per-cell totals, summed over every cell outside the 3x3 block that is within the radius
+        cell = cx * rows + cy
+        channels = [np.ones(len(cell)), self.pos[:, 0], self.pos[:, 1], self.direction[:, 0], self.direction[:, 1]]
+        grid = np.stack([np.bincount(cell, weights=channel, minlength=cols * rows) for channel in channels], axis=-1)
+        grid = grid.reshape(cols, rows, len(channels))
+
+        reach = math.ceil(radius / cell_size)
+        padded = np.pad(grid, ((reach, reach), (reach, reach), (0, 0)))
+        far = np.zeros_like(grid)
+        for ox in range(-reach, reach + 1):
+            for oy in range(-reach, reach + 1):
+                # Cells on the edge of the radius count partly, by how far their centre is inside it
+                share = min(1.0, (radius - math.hypot(ox, oy) * cell_size) / cell_size + 0.5)
+                if max(abs(ox), abs(oy)) <= 1 or share <= 0:
+                    continue
+                far += share * padded[reach + ox:reach + ox + cols, reach + oy:reach + oy + rows]
+
+        bird_far = far[cx, cy]
+        return bird_far[:, 0], bird_far[:, 1:3], bird_far[:, 3:5]
+
+    def near_sums(self, cx: np.ndarray, cy: np.ndarray, cols: int, rows: int, radius: float):
+        # Exact sums over the birds in the 3x3 cells around every bird
+        n = len(self.pos)
+        counts = np.zeros(n, dtype=np.float64)
+        pos_sums = np.zeros((n, 2), dtype=np.float64)
+        dir_sums = np.zeros((n, 2), dtype=np.float64)
+
+        # Birds sorted by cell, so every cell is a contiguous range
+        cell = cx * rows + cy
+        order = np.argsort(cell, kind='stable')
+        starts = np.searchsorted(cell[order], np.arange(cols * rows), side='left')
+        ends = np.searchsorted(cell[order], np.arange(cols * rows), side='right')
+
+        for ox in (-1, 0, 1):
+            for oy in (-1, 0, 1):
+                nx, ny = cx + ox, cy + oy
+                valid = (nx >= 0) & (nx < cols) & (ny >= 0) & (ny < rows)
+                other = np.where(valid, nx * rows + ny, 0)
+                lengths = np.where(valid, ends[other] - starts[other], 0)
+
+                # Expand (bird, other cell) into bird pairs, in blocks of about BLOCK_ELEMENTS pairs
+                total = np.cumsum(lengths)
+                bounds = np.searchsorted(total, np.arange(BLOCK_ELEMENTS, total[-1] if n else 0, BLOCK_ELEMENTS))
+                for first, last in zip(np.r_[0, bounds], np.r_[bounds, n]):
+                    if first == last:
+                        continue
+                    block_lengths = lengths[first:last]
+                    i = np.repeat(np.arange(first, last), block_lengths)
+                    offsets = np.arange(len(i)) - np.repeat(np.cumsum(block_lengths) - block_lengths, block_lengths)
+                    j = order[np.repeat(starts[other[first:last]], block_lengths) + offsets]
+
+                    diff = self.pos[i] - self.pos[j]
+                    keep = (np.einsum('ij,ij->i', diff, diff) <= radius * radius) & (i != j)
+                    i, j = i[keep], j[keep]
+
+                    counts += np.bincount(i, minlength=n)
+                    for axis in range(2):
+                        pos_sums[:, axis] += np.bincount(i, weights=self.pos[j, axis], minlength=n)
+                        dir_sums[:, axis] += np.bincount(i, weights=self.direction[j, axis], minlength=n)
+
+        return counts, pos_sums, dir_sums
+
+    def neighbour_sums(self, radius: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        cell_size = radius / self.resolution
+        cx, cy, cols, rows = self._cells(cell_size)
+
+        counts, pos_sums, dir_sums = self.near_sums(cx, cy, cols, rows, radius)
+        far_counts, far_pos, far_dir = self.far_sums(cx, cy, cols, rows, cell_size, radius)
+        return counts + far_counts, pos_sums + far_pos, dir_sums + far_dir
+
+    def steering_error(self, radius: float, weights: tuple[float, float, float], sample: int = 500,
+                       seed: int = 0) -> float:
+        # Mean angle (degrees) between the approximate and the exact new direction, over a sample of birds
+        rows = np.random.default_rng(seed).choice(len(self.pos), size=min(sample, len(self.pos)), replace=False)
+
+        approximate = [values[rows] for values in self.neighbour_sums(radius)]
+        exact = self.exact_sums(rows, radius)
+
+        a = self.steering(rows, *approximate, weights)
+        b = self.steering(rows, *exact, weights)
+        cos = np.clip(np.einsum('ij,ij->i', normalize_rows(a), normalize_rows(b)), -1, 1)
+        return float(np.degrees(np.arccos(cos)).mean())
@@ -1,11 +1,19 @@
-from math import sqrt
 from enum import Enum, auto
+from time import perf_counter
 
 import pygame as pg
 from pygame.math import Vector2
+from pygame.surface import Surface
 from vi import Agent, Simulation
 from vi.config import Config, dataclass, deserialize
 
+from engine import GRID_RESOLUTION, FlockEngine, GridFlockEngine
+
+BIRD_VELOCITY = 2
+
+OVERLAY_FONT_SIZE = 24
+OVERLAY_LINE_HEIGHT = 20
+
 
 @deserialize
 @dataclass
@@ -18,6 +26,24 @@ class FlockingConfig(Config):
 
     mass: int = 20
 
+    # Steer the whole flock with the NumPy engine instead of Bird.change_position
+    vectorized: bool = True
+
+    # Approximate rules from per-cell totals (GridFlockEngine), for flocks far too big for the exact pairwise check.
+    # grid_resolution is the number of cells per radius: 1 is exact, from 2 up higher is closer to the exact rules
+    # (see GRID_RESOLUTION for measured errors and step times)
+    approximate: bool = False
+    grid_resolution: int = GRID_RESOLUTION
+
+    # Decoupled rendering: the window is only redrawn every `render_every` ticks, or at most `render_fps` times
+    # a second (wins when set), and the ticks in between run as fast as they can.
+    # At the defaults every tick is drawn and capped at fps_limit, like vi does
+    render_every: int = 1
+    render_fps: float = 0.0
+
+    # Weights, selection and tick rate drawn in the corner of the window
+    overlay: bool = True
+
     def weights(self) -> tuple[float, float, float]:
         return (self.alignment_weight, self.cohesion_weight, self.separation_weight)
 
@@ -25,15 +51,24 @@ class FlockingConfig(Config):
 class Bird(Agent):
     config: FlockingConfig
 
+    def __init__(self, images: list[Surface], simulation: 'FlockingLive', pos: Vector2 | None = None,
+                 move: Vector2 | None = None):
+        super().__init__(images, simulation, pos, move)
+        self.simulation = simulation
+
     def change_position(self):
+        # FlockingLive moves the flock in one batch, this is only the per-bird reference path
+        if self.config.vectorized:
+            return
+
         # Pac-man-style teleport to the other end of the screen when trying to escape
         self.there_is_no_escape()
         
         self.direction = self.move.normalize()
-        self.velocity = 2
+        self.velocity = BIRD_VELOCITY
 
-        neighborhood = self.in_proximity_accuracy()
-        num_neighbors = self.in_proximity_accuracy().count()
+        neighborhood = self.simulation.neighbours(self)
+        num_neighbors = len(neighborhood)
 
         if num_neighbors > 0:
             total_dirs = self.direction.copy()
@@ -66,7 +101,8 @@ class Bird(Agent):
             cohesion = cohesion_force - self.direction
 
             
-            self.move = self.direction + (FlockingConfig().alignment_weight * avg_dir) + (FlockingConfig().separation_weight * avg_separation_dir) + (FlockingConfig().cohesion_weight * cohesion) 
+            alignment_weight, cohesion_weight, separation_weight = self.config.weights()
+            self.move = self.direction + (alignment_weight * avg_dir) + (separation_weight * avg_separation_dir) + (cohesion_weight * cohesion)
             self.move = self.move.normalize()
 
 
@@ -74,6 +110,19 @@ class Bird(Agent):
 
 
 
+class UncappedClock:
+    # Stands in for vi's pg.time.Clock when rendering is decoupled: frames are still timed for the fps metrics,
+    # but vi's after_update can't hold the ticks back to fps_limit
+    def __init__(self):
+        self._clock = pg.time.Clock()
+
+    def tick(self, framerate: float = 0) -> int:
+        return self._clock.tick()
+
+    def get_fps(self) -> float:
+        return self._clock.get_fps()
+
+
 class Selection(Enum):
     ALIGNMENT = auto()
     COHESION = auto()
@@ -83,6 +132,36 @@ class Selection(Enum):
 class FlockingLive(Simulation):
     selection: Selection = Selection.ALIGNMENT
     config: FlockingConfig
+    engine: FlockEngine | None = None
+
+    def __init__(self, config: FlockingConfig | None = None):
+        super().__init__(config)
+        self._neighbours: dict[int, list[tuple[Bird, float]]] = {}
+
+        self._render = True
+        self._last_render = perf_counter()
+        self._last_render_tick = 0
+        self._tick_rate = 0.0
+        self._printed_weights: tuple[float, float, float] | None = None
+        self._font: pg.font.Font | None = None
+
+        if self.decoupled:
+            self._clock = UncappedClock()
+
+    @property
+    def decoupled(self) -> bool:
+        return self.config.render_every > 1 or self.config.render_fps > 0
+
+    def should_render(self) -> bool:
+        if self.config.render_fps > 0:
+            return perf_counter() - self._last_render >= 1 / self.config.render_fps
+        return self.shared.counter % self.config.render_every == 0
+
+    def neighbours(self, agent: Bird) -> list[tuple[Bird, float]]:
+        # Proximity is worked out once per bird per tick, no matter how often it's asked for
+        if agent.id not in self._neighbours:
+            self._neighbours[agent.id] = list(agent.in_proximity_accuracy())
+        return self._neighbours[agent.id]
 
     def handle_event(self, by: float):
         if self.selection == Selection.ALIGNMENT:
@@ -93,11 +172,20 @@ class FlockingLive(Simulation):
             self.config.separation_weight += by
 
     def before_update(self):
-        super().before_update()
+        self._render = self.should_render()
+        if self._render:
+            # vi handles quitting and the radius keys, then clears the screen
+            super().before_update()
 
         for event in pg.event.get():
-            if event.type == pg.KEYDOWN:
-                if event.key == pg.K_UP:
+            if event.type == pg.QUIT:
+                self.stop()
+            elif event.type == pg.KEYDOWN:
+                if event.key == pg.K_HOME:
+                    self.config.radius += 1
+                elif event.key == pg.K_END:
+                    self.config.radius -= 1
+                elif event.key == pg.K_UP:
                     self.handle_event(by=0.1)
                 elif event.key == pg.K_DOWN:
                     self.handle_event(by=-0.1)
@@ -108,19 +196,76 @@ class FlockingLive(Simulation):
                 elif event.key == pg.K_3:
                     self.selection = Selection.SEPARATION
 
+        self.print_weights()
+
+        # Drawn after vi clears the screen, so the birds fly over it
+        if self._render and self.config.overlay:
+            self.draw_overlay()
+
+        if self.config.vectorized:
+            self.update_flock()
+
+    def print_weights(self):
+        # Only when they changed, printing every frame slows the loop down by itself
+        weights = self.config.weights()
+        if weights != self._printed_weights:
+            a, c, s = weights
+            print(f"A: {a:.3f} - C: {c:.3f} - S: {s:.3f}")
+            self._printed_weights = weights
+
+    def after_update(self):
+        # Only the ticks that are drawn go through vi's after_update (draw, flip, clock and fps metrics)
+        if self._render:
+            super().after_update()
+
+            now = perf_counter()
+            self._tick_rate = (self.shared.counter + 1 - self._last_render_tick) / max(now - self._last_render, 1e-9)
+            self._last_render = now
+            self._last_render_tick = self.shared.counter + 1
+
+        self._neighbours.clear()
+
+    def draw_overlay(self):
+        if self._font is None:
+            pg.font.init()
+            self._font = pg.font.Font(None, OVERLAY_FONT_SIZE)
+
         a, c, s = self.config.weights()
-        print(f"A: {a:.3f} - C: {c:.3f} - S: {s:.3f}")
+        lines = [
+            f"A: {a:.3f}  C: {c:.3f}  S: {s:.3f}",
+            f"Editing {self.selection.name.lower()} (1/2/3, up/down)",
+            f"{len(self._agents)} birds, {self._tick_rate:.0f} ticks/s",
+        ]
+        for i, line in enumerate(lines):
+            self._screen.blit(self._font.render(line, True, 'white'), (10, 10 + i * OVERLAY_LINE_HEIGHT))
+
+    def update_flock(self):
+        birds = self._agents.sprites()
+
+        # (Re)build the arrays whenever birds were spawned or killed
+        if self.engine is None or len(self.engine) != len(birds):
+            width, height = self.config.window.as_tuple()
+            if self.config.approximate:
+                self.engine = GridFlockEngine.from_agents(birds, width, height, BIRD_VELOCITY,
+                                                          resolution=self.config.grid_resolution)
+            else:
+                self.engine = FlockEngine.from_agents(birds, width, height, BIRD_VELOCITY)
+
+        self.engine.step(self.config.radius, self.config.weights())
+        self.engine.write_back(birds)
 
 
-(
-    FlockingLive(
-        FlockingConfig(
-            image_rotation=True,
-            movement_speed=1,
-            radius=75,
-            seed=1,
+if __name__ == '__main__':
+    (
+        FlockingLive(
+            FlockingConfig(
+                image_rotation=True,
+                movement_speed=1.0,
+                radius=75,
+                seed=1,
+                render_fps=60.0,
+            )
         )
+        .batch_spawn_agents(80, Bird, images=["images/bird.png"])
+        .run()
     )
-    .batch_spawn_agents(80, Bird, images=["PCI-Nexus/images/bird.png"])
-    .run()
-)
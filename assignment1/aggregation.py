@@ -1,67 +1,107 @@
-from PIL import Image
-import pygame as pg
 from pygame.math import Vector2
 from pygame.surface import Surface
-from vi import Simulation, Agent
+from vi import Agent
 from vi.config import Config
 from vi.simulation import HeadlessSimulation
-import random
-import math
+from collections import Counter
+from dataclasses import dataclass, field
+from multiprocessing import Pool
 import matplotlib.pyplot as plt
 import polars as pl
 import numpy as np
 
+from common.recorder import Recorder
+from common.scheduler import Scheduler
+from common.stopping import StopCondition, stop_reason
+from common.streams import CounterRandom, GlobalRandom
+from engine import AggregationEngine, COUNT_KEYS, COUNTS_SCHEMA, LEAVE_TICKS, join_probability, leave_probability, neighbour_counts, state_populations
+from sites import CircleSites
+
+CHECK_INTERVAL = 50
+
 class Cockroach(Agent):
+    # Frozen cockroaches sleep: they're skipped by change_position and keep their row in the position index
+    asleep = False
+
     def __init__(self, images: list[Surface], simulation: HeadlessSimulation, pos: Vector2 | None = None, move: Vector2 | None = None):
+        # Set before vi's __init__, which calls on_spawn
+        self.simulation = simulation
         super().__init__(images, simulation, pos, move)
         self.state = "wandering"
         self.direction = self.move.normalize()
         self.velocity = simulation.config.movement_speed
 
-        self.check_interval = 50
+        self.check_interval = CHECK_INTERVAL
 
         self.left_on_tick = float('inf')
+
+        if simulation.scheduler is not None:
+            simulation.scheduler.add(self)
     
+    def on_spawn(self):
+        self.simulation.rng.place(self)
+
+    def freeze_movement(self):
+        super().freeze_movement()
+        self.simulation.sleep(self)
+
+    def continue_movement(self):
+        super().continue_movement()
+        self.simulation.wake(self)
+
+    def next_update(self, tick: int) -> int:
+        # Wandering and joining agents check their site every tick. Still agents only decide on check ticks and
+        # leaving agents only wait out LEAVE_TICKS, once they've (un)frozen their movement
+        if self.state in ('wandering', 'join'):
+            return tick + 1
+        if self.state == 'still':
+            if self._moving:
+                return tick + 1
+            return (tick // self.check_interval + 1) * self.check_interval
+        if not self._moving:
+            return tick + 1
+        return max(tick + 1, self.left_on_tick + LEAVE_TICKS)
+
     def _calculate_join_probability(self, n):
-        a = 0.03
-        b = 0.48
-        c = 0.64
-        prob = a + b * (1 - math.e**(-c * n))
-        # print(prob)
-        return prob
+        return join_probability(n)
     
     def _calculate_leave_probability(self, n):
-        a = 0.85
-        b = 1
-        prob = a * math.e**(-b * n) + 0.0001
-        # print(prob)
-        return prob
+        return leave_probability(n)
 
-    def update(self):
-        self.save_data("state", self.state)
-        
-        site_id = -1 if self.on_site_id() == None else self.on_site_id()
+    def on_site_id(self):
+        site_id = self.simulation.site_of(self)
+        return None if site_id == -1 else site_id
+
+    def _count_neighbors(self):
+        # Only needed on the ticks where a join/leave decision is made
+        return self.simulation.neighbour_count(self)
+
+    def recorded_site_id(self):
+        # Wandering agents are never counted towards a site
         if self.state == 'wandering':
-            site_id = -1
-        self.save_data("on_site_id", site_id)
-        
-        num_neighbors = self.in_proximity_accuracy().count()
+            return -1
+        return self.simulation.site_of(self)
+
+    def update(self):
+        # Site membership is also reused by the state checks below
+        on_site = self.on_site_id() is not None
 
         if self.state == 'wandering':
             self.continue_movement()
 
             # Change state to join if agent currently on a site
-            if self.on_site():
+            if on_site:
                 self.state = 'join'
     
         elif self.state == 'join':
             # If agents go off the site change back to wandering (prevents stopping after leaving the site)
-            if not self.on_site():
+            if not on_site:
                 self.state = 'wandering'
 
             # Join with some probability every 50 ticks
             if self.shared.counter % self.check_interval == 0:
-                if random.random() < self._calculate_join_probability(num_neighbors):
+                rng = self.simulation.rng.stream(self.id, self.shared.counter, 'update')
+                if rng.random() < self._calculate_join_probability(self._count_neighbors()):
                     self.state = 'still'
         
         elif self.state == 'still':
@@ -69,14 +109,15 @@ class Cockroach(Agent):
 
             # Enter leave state with some probability every 50 ticks
             if self.shared.counter % self.check_interval == 0:
-                if random.random() < self._calculate_leave_probability(num_neighbors):
+                rng = self.simulation.rng.stream(self.id, self.shared.counter, 'update')
+                if rng.random() < self._calculate_leave_probability(self._count_neighbors()):
                     self.left_on_tick = self.shared.counter
                     self.state = 'leave'
         
         else:
             # Continue movement & don't enter wandering again for some number of ticks
             self.continue_movement()
-            if self.shared.counter == self.left_on_tick + 500:
+            if self.shared.counter == self.left_on_tick + LEAVE_TICKS:
                 self.left_on_tick = float('inf')
                 self.state = 'wandering'
         
@@ -84,6 +125,7 @@ class Cockroach(Agent):
         if not self._moving:
             return
 
+        rng = self.simulation.rng.stream(self.id, self.shared.counter, 'move')
         self.direction = self.move.normalize()
 
         if self.pos.x + (self.direction.x * 5) < self._area.left:
@@ -95,33 +137,155 @@ class Cockroach(Agent):
         elif self.pos.y + (self.direction.y * 5) > self._area.bottom:
             self.direction.y *= -1
 
-        if random.random() < 0.005:
-            self.direction = Vector2(random.uniform(-1, 1), random.uniform(-1, 1))
+        if rng.random() < 0.005:
+            self.direction = Vector2(rng.uniform(-1, 1), rng.uniform(-1, 1))
             self.direction = self.direction.normalize()
 
         self.move = self.direction * self.velocity
         self.pos += self.move
 
 
-def plot_wandering_vs_site_total(snapshots, title):
-    # Create dataframe from metrics
-    df = snapshots.drop(['x', 'y', 'image_index'])
+class AggregationSimulation(HeadlessSimulation):
+    def __init__(self, config: Config | None = None, record_interval: int = CHECK_INTERVAL,
+                 stop_conditions: list[StopCondition] | None = None, counter_rng: bool = False,
+                 scheduled_updates: bool = False):
+        super().__init__(config)
+
+        # Counter-based draws give the same run as the batched AggregationEngine with the same seed
+        self.rng = CounterRandom(self.config.seed) if counter_rng else GlobalRandom()
+        self.sites = CircleSites()
+        self._rows: dict[int, int] = {}
+        self._positions = np.zeros((0, 2))
+        self._site_ids = np.zeros(0, dtype=np.int64)
+        self._positions_frame = -1
+
+        # Agents that aren't asleep, in sprite order. Rebuilt when one falls asleep, wakes up or spawns
+        self._awake: list[Agent] | None = None
+        self._awake_total = 0
+
+        # Running (frame, state, on_site_id) counts instead of a snapshot row per agent per frame
+        self.recorder = Recorder(record_interval, COUNT_KEYS, COUNTS_SCHEMA)
+
+        # Checked on every recorded frame against the populations counted there
+        self.stop_conditions = stop_conditions or []
+        self.stop_reason: str | None = None
+        self.populations: dict[str, int] = {}
+
+        # Cockroaches are only updated on the ticks they act on (see common/scheduler.py) instead of every frame
+        self.scheduler = Scheduler() if scheduled_updates else None
+
+    def spawn_circle_site(self, x, y, radius):
+        self.sites.add(x, y, radius)
+        return self
+
+    def sleep(self, agent):
+        if not agent.asleep:
+            agent.asleep = True
+            self._awake = None
+
+    def wake(self, agent):
+        if agent.asleep:
+            agent.asleep = False
+            self._awake = None
+
+    def awake_agents(self) -> list[Agent]:
+        if self._awake is None or self._awake_total != len(self._agents):
+            self._awake = [agent for agent in self._agents.sprites() if not agent.asleep]
+            self._awake_total = len(self._agents)
+        return self._awake
+
+    def _update_positions(self):
+        # Positions (and site membership) of the agents are gathered in one go, the first time they're needed in a tick.
+        # Asleep agents haven't moved, so only the rows of awake agents are refreshed
+        if self._positions_frame == self.shared.counter:
+            return
 
-    # Only use data from every 50 frames
-    df = df.filter(
-        (pl.col('frame') % 50 == 0)
-    )
+        if len(self._rows) != len(self._agents):
+            agents = self._agents.sprites()
+            self._rows = {agent.id: row for row, agent in enumerate(agents)}
+            self._positions = np.array([(agent.pos.x, agent.pos.y) for agent in agents], dtype=np.float64).reshape(-1, 2)
+            self._site_ids = self.sites.membership(self._positions)
+        else:
+            awake = self.awake_agents()
+            rows = np.array([self._rows[agent.id] for agent in awake], dtype=np.int64)
+            self._positions[rows] = np.array([(agent.pos.x, agent.pos.y) for agent in awake], dtype=np.float64).reshape(-1, 2)
+            self._site_ids[rows] = self.sites.membership(self._positions[rows])
+        self._positions_frame = self.shared.counter
+
+    def site_of(self, agent):
+        self._update_positions()
+        row = self._rows.get(agent.id)
+        return -1 if row is None else int(self._site_ids[row])
+
+    def neighbour_count(self, agent):
+        # Exact distances, the same check as the batched engine
+        self._update_positions()
+        return int(neighbour_counts(self._positions, np.array([self._rows[agent.id]]), self.config.radius)[0])
+
+    def record_states(self):
+        frame = self.shared.counter
+        counts = Counter((agent.state, agent.recorded_site_id()) for agent in self._agents.sprites())
+        for (state, site_id), count in counts.items():
+            self.recorder.record(frame, count, state=state, on_site_id=site_id)
+
+        self.populations = state_populations(counts)
+
+    def counts(self):
+        return self.recorder.to_polars()
+
+    def tick(self):
+        # Same order as HeadlessSimulation.tick, but states are counted instead of saving snapshots
+        self.before_update()
+
+        for agent in self.awake_agents():
+            agent.change_position()
+
+        # No vi proximity grid to rebuild: neighbour counts come from the position index of _update_positions
+
+        # States are recorded before the agents update, like the old save_data calls
+        if self.recorder.should_record(self.shared.counter):
+            self.record_states()
+
+        if self.scheduler is not None:
+            due = self.scheduler.due(self.shared.counter)
+            for agent in due:
+                agent.update()
+            self.scheduler.done(due)
+        else:
+            self._all.update()
+        self.after_update()
+
+        if self.config.duration > 0 and self.shared.counter == self.config.duration:
+            self.stop_reason = f'reached the duration of {self.config.duration} frames'
+            self.stop()
+            return
 
+        if self.recorder.should_record(self.shared.counter):
+            reason = stop_reason(self.stop_conditions, self.shared.counter, lambda: self.populations)
+            if reason is not None:
+                self.stop_reason = reason
+                self.stop()
+                return
+
+        self.shared.counter += 1
+
+    def run(self):
+        metrics = super().run()
+        metrics.stop_reason = self.stop_reason
+        return metrics
+
+
+def plot_wandering_vs_site_total(counts, title):
     # Get x values for padding later
-    x_values = df.drop('id', 'state', 'on_site_id').groupby('frame', maintain_order=True).agg(pl.count('*'))['frame'].to_list()
+    x_values = counts.groupby('frame', maintain_order=True).agg(pl.count('*'))['frame'].to_list()
 
     # Calcualte frame range for padding later
-    arr = np.arange(0, max(x_values) + 1, step=50)
+    arr = np.arange(0, max(x_values) + 1, step=CHECK_INTERVAL)
     arr = arr.astype(np.int64)
     frame_range = pl.DataFrame({'frame': arr})
 
-    # Group by frame, state & on_site_id and filter out all unneeded rows
-    grouped = df.groupby(["frame", "state"], maintain_order=True).agg(pl.count("id").alias("count"))
+    # Sum the counts of all sites & filter out all unneeded rows
+    grouped = counts.groupby(["frame", "state"], maintain_order=True).agg(pl.sum("count").alias("count"))
     filtered = grouped.filter(
         ((pl.col('state') == 'wandering') | ((pl.col('state') == 'still')))
     )
@@ -147,30 +311,21 @@ def plot_wandering_vs_site_total(snapshots, title):
     plt.legend()
     plt.savefig(f'assignment1/graphs/{title}.png')
 
-def plot_site_populations(num_sites, snapshots):
+def plot_site_populations(num_sites, counts):
     lines = ['wandering']
     for _ in range(num_sites):
         lines.append('still')
 
-    # Create dataframe from metrics
-    df = snapshots.drop(['x', 'y', 'image_index'])
-
-    # Only use data from every 50 frames
-    df = df.filter(
-        (pl.col('frame') % 50 == 0)
-    )
-
     # Get x values for padding later
-    x_values = df.drop('id', 'state', 'on_site_id').groupby('frame', maintain_order=True).agg(pl.count('*'))['frame'].to_list()
+    x_values = counts.groupby('frame', maintain_order=True).agg(pl.count('*'))['frame'].to_list()
 
     # Calcualte frame range for padding later
-    arr = np.arange(0, max(x_values) + 1, step=50)
+    arr = np.arange(0, max(x_values) + 1, step=CHECK_INTERVAL)
     arr = arr.astype(np.int64)
     frame_range = pl.DataFrame({'frame': arr})
 
-    # Group by frame, state & on_site_id and filter out all unneeded rows
-    grouped = df.groupby(["frame", "state", "on_site_id"], maintain_order=True).agg(pl.count("id").alias("count"))
-    filtered = grouped.filter(
+    # Filter out all unneeded rows
+    filtered = counts.filter(
         ((pl.col('state') == 'wandering') | ((pl.col('state') == 'still') & (pl.col('on_site_id').is_in(range(num_sites)))))
     )
 
@@ -202,147 +357,103 @@ def plot_site_populations(num_sites, snapshots):
     plt.legend()
     plt.show()
 
-config = Config()
-x, y = config.window.as_tuple()
 
-site = Image.open('images/circle.png')
-site = site.resize((200,200))
-site.save('images/circle_resized.png')
-
-site = Image.open('images/circle.png')
-site = site.resize((141,141))
-site.save('images/circle_resized2.png')
-
-site = Image.open('images/circle.png')
-site = site.resize((115,115))
-site.save('images/circle_resized3.png')
-
-site = Image.open('images/circle.png')
-site = site.resize((100,100))
-site.save('images/circle_resized4.png')
-
-site = Image.open('images/circle.png')
-site = site.resize((89,89))
-site.save('images/circle_resized5.png')
-
-site = Image.open('images/circle.png')
-site = site.resize((81,81))
-site.save('images/circle_resized6.png')
-
-metrics = (
-    Simulation(
-        Config(
-            image_rotation=False,
-            movement_speed=1.35,
-            radius=50,
-            fps_limit=144,
-            duration=20000,
-        )
-    )
-    .spawn_site("images/circle_resized.png", x // 2, y // 2)
-    .batch_spawn_agents(100, Cockroach, ["images/white.png"])
-    .run()
-)
-
-plot_wandering_vs_site_total(metrics.snapshots, 'Single Site (Size 200)')
-
-metrics = (
-    Simulation(
-        Config(
-            image_rotation=False,
-            movement_speed=1.35,
-            radius=50,
-            fps_limit=6000,
-            duration=20000,
-        )
-    )
-    .spawn_site("images/circle_resized2.png", 225, y // 2)
-    .spawn_site("images/circle_resized2.png", 525, y // 2)
-    .batch_spawn_agents(100, Cockroach, ["images/white.png", "images/red.png"])
-    .run()
-)
-
-plot_wandering_vs_site_total(metrics.snapshots, 'Two Sites (Size 141)')
-
-metrics = (
-    Simulation(
-        Config(
-            image_rotation=False,
-            movement_speed=1.35,
-            radius=50,
-            fps_limit=6000,
-            duration=20000,
-        )
-    )
-    .spawn_site("images/circle_resized3.png", 200, 550)
-    .spawn_site("images/circle_resized3.png", 550, 550)
-    .spawn_site("images/circle_resized3.png", x // 2, 200)
-    .batch_spawn_agents(100, Cockroach, ["images/white.png", "images/red.png"])
-    .run()
-)
-
-plot_wandering_vs_site_total(metrics.snapshots, 'Three Sites (Size 115)')
-
-metrics = (
-    Simulation(
-        Config(
-            image_rotation=False,
-            movement_speed=1.35,
-            radius=50,
-            fps_limit=6000,
-            duration=20000,
-        )
+@dataclass
+class Scenario:
+    title: str
+    sites: list[tuple[int, int]]
+    site_size: int
+    agents: int = 100
+    images: list[str] = field(default_factory=lambda: ["images/white.png", "images/red.png"])
+    config: Config = field(default_factory=lambda: Config(
+        image_rotation=False,
+        movement_speed=1.35,
+        radius=50,
+        duration=20000,
+    ))
+
+    # Run the batched AggregationEngine instead of Cockroach agents (for thousands of agents)
+    vectorized: bool = False
+
+    # End the run early, e.g. once the site populations have settled
+    stop_conditions: list[StopCondition] = field(default_factory=list)
+
+    # Counter-based random draws (the batched engine always uses them), so both paths can be compared
+    counter_rng: bool = False
+
+    # Only update cockroaches on the ticks they act on
+    scheduled_updates: bool = False
+
+
+def run_batched_scenario(scenario):
+    config = scenario.config
+    width, height = config.window.as_tuple()
+
+    sites = CircleSites()
+    for site_x, site_y in scenario.sites:
+        sites.add(site_x, site_y, scenario.site_size / 2)
+
+    engine = AggregationEngine(
+        scenario.agents,
+        sites,
+        width,
+        height,
+        velocity=config.movement_speed,
+        radius=config.radius,
+        check_interval=CHECK_INTERVAL,
+        record_interval=CHECK_INTERVAL,
+        seed=config.seed,
     )
-    .spawn_site("images/circle_resized4.png", 200, 200)
-    .spawn_site("images/circle_resized4.png", 550, 200)
-    .spawn_site("images/circle_resized4.png", 200, 550)
-    .spawn_site("images/circle_resized4.png", 550, 550)
-    .batch_spawn_agents(100, Cockroach, ["images/white.png", "images/red.png"])
-    .run()
-)
-
-
-plot_wandering_vs_site_total(metrics.snapshots, 'Four Sites (Size 100)')
-
-metrics = (
-    Simulation(
-        Config(
-            image_rotation=False,
-            movement_speed=1.35,
-            radius=50,
-            fps_limit=6000,
-            duration=20000,
-        )
-    )
-    .spawn_site("images/circle_resized5.png", 175, 175)
-    .spawn_site("images/circle_resized5.png", 575, 175)
-    .spawn_site("images/circle_resized5.png", 175, 575)
-    .spawn_site("images/circle_resized5.png", 575, 575)
-    .spawn_site("images/circle_resized5.png", x // 2, y // 2)
-    .batch_spawn_agents(100, Cockroach, ["images/white.png", "images/red.png"])
-    .run()
-)
-
-plot_wandering_vs_site_total(metrics.snapshots, 'Five Sites (Size 89)')
-
-metrics = (
-    Simulation(
-        Config(
-            image_rotation=False,
-            movement_speed=1.35,
-            radius=50,
-            fps_limit=6000,
-            duration=20000,
-        )
+    return engine.run(config.duration, scenario.stop_conditions), engine.stop_reason
+
+
+def run_scenario(scenario):
+    if scenario.vectorized:
+        return run_batched_scenario(scenario)
+
+    simulation = AggregationSimulation(scenario.config, stop_conditions=scenario.stop_conditions,
+                                       counter_rng=scenario.counter_rng, scheduled_updates=scenario.scheduled_updates)
+
+    # Site size is the diameter of the circle
+    for site_x, site_y in scenario.sites:
+        simulation.spawn_circle_site(site_x, site_y, scenario.site_size / 2)
+
+    metrics = (
+        simulation
+        .batch_spawn_agents(scenario.agents, Cockroach, scenario.images)
+        .run()
     )
-    .spawn_site("images/circle_resized6.png", 200, 150)
-    .spawn_site("images/circle_resized6.png", 550, 150)
-    .spawn_site("images/circle_resized6.png", 200, y // 2)
-    .spawn_site("images/circle_resized6.png", 550, y // 2)
-    .spawn_site("images/circle_resized6.png", 200, 600)
-    .spawn_site("images/circle_resized6.png", 550, 600)
-    .batch_spawn_agents(100, Cockroach, ["images/white.png", "images/red.png"])
-    .run()
-)
-
-plot_wandering_vs_site_total(metrics.snapshots, 'Six Sites (Size 81)')
\ No newline at end of file
+
+    # Only send the compact table (and why the run ended) back to the parent process
+    return simulation.counts(), metrics.stop_reason
+
+
+def run_scenarios(scenarios, processes=None):
+    # Runs are independent, so total time is roughly that of the slowest scenario
+    with Pool(processes or len(scenarios)) as pool:
+        results = pool.map(run_scenario, scenarios)
+
+    # Categorical columns can't be sent back from the workers, so states are only made categorical here
+    return [(counts.with_columns(pl.col('state').cast(pl.Categorical)), reason) for counts, reason in results]
+
+
+config = Config()
+x, y = config.window.as_tuple()
+
+SCENARIOS = [
+    Scenario('Single Site (Size 200)', [(x // 2, y // 2)], 200, images=["images/white.png"]),
+    Scenario('Two Sites (Size 141)', [(225, y // 2), (525, y // 2)], 141),
+    Scenario('Three Sites (Size 115)', [(200, 550), (550, 550), (x // 2, 200)], 115),
+    Scenario('Four Sites (Size 100)', [(200, 200), (550, 200), (200, 550), (550, 550)], 100),
+    Scenario('Five Sites (Size 89)', [(175, 175), (575, 175), (175, 575), (575, 575), (x // 2, y // 2)], 89),
+    Scenario('Six Sites (Size 81)', [(200, 150), (550, 150), (200, y // 2), (550, y // 2), (200, 600), (550, 600)], 81),
+]
+
+
+if __name__ == '__main__':
+    results = run_scenarios(SCENARIOS)
+
+    # Plot once every run has finished
+    for scenario, (counts, reason) in zip(SCENARIOS, results):
+        print(f'{scenario.title}: {reason}')
+        plot_wandering_vs_site_total(counts, scenario.title)
@@ -0,0 +1,195 @@
+import math
+
+import numpy as np
+import polars as pl
+
+from common.recorder import Recorder, Schema
+from common.vectors import BLOCK_ELEMENTS, normalize_rows
+from common.stopping import StopCondition, stop_reason
+from common.streams import CounterRandom
+from sites import CircleSites
+
+WANDERING, JOIN, STILL, LEAVE = range(4)
+STATES = ['wandering', 'join', 'still', 'leave']
+
+# Compact result table: number of agents per (frame, state, on_site_id), every `record_interval` frames.
+# There are only a few sites, so on_site_id fits in a small int (states are made categorical by run_scenarios)
+COUNT_KEYS = ('state', 'on_site_id')
+COUNTS_SCHEMA = Schema(dtypes={'state': pl.Utf8, 'on_site_id': pl.Int8})
+
+# Ticks a cockroach keeps moving after leaving a site before it can join again
+LEAVE_TICKS = 500
+
+
+def join_probability(n):
+    a = 0.03
+    b = 0.48
+    c = 0.64
+    return a + b * (1 - np.exp(-c * n))
+
+
+def leave_probability(n):
+    a = 0.85
+    b = 1
+    return a * np.exp(-b * n) + 0.0001
+
+
+def state_populations(counts: dict[tuple[str, int], int]) -> dict[str, int]:
+    # Cockroaches per state, plus the still ones per site ('site 0', 'site 1', ...)
+    populations = dict.fromkeys(STATES, 0)
+    for (state, site_id), count in counts.items():
+        populations[state] += count
+        if state == 'still' and site_id >= 0:
+            populations[f'site {site_id}'] = populations.get(f'site {site_id}', 0) + count
+    return populations
+
+
+def neighbour_counts(pos: np.ndarray, rows: np.ndarray, radius: float) -> np.ndarray:
+    # Number of other positions within the radius, only for the requested rows
+    # (distances like Vector2.distance_to, compared like vi's in_proximity_accuracy)
+    counts = np.zeros(len(rows), dtype=np.int64)
+    block = max(1, BLOCK_ELEMENTS // max(len(pos), 1))
+    for start in range(0, len(rows), block):
+        chunk = rows[start:start + block]
+        dx = pos[chunk, None, 0] - pos[None, :, 0]
+        dy = pos[chunk, None, 1] - pos[None, :, 1]
+        in_range = np.sqrt(dx * dx + dy * dy) <= radius
+        counts[start:start + block] = in_range.sum(axis=1) - 1
+    return counts
+
+
+class AggregationEngine:
+    # Same rules as Cockroach, but for the whole population at once:
+    # states are an integer array and every random draw is a vectorized batch.
+    # Draws are counter-based, so with the same seed this is the same run as
+    # AggregationSimulation(counter_rng=True) with agents 0 up to count
+    def __init__(self, count: int, sites: CircleSites, width: int, height: int, velocity: float, radius: float,
+                 check_interval: int, record_interval: int, seed: int | None = None):
+        self.rng = CounterRandom(seed)
+        self.ids = np.arange(count)
+
+        self.sites = sites
+        self.width = width
+        self.height = height
+        self.velocity = velocity
+        self.radius = radius
+        self.check_interval = check_interval
+
+        # Like CounterRandom.place: x, y and the angle of the first move
+        spawn = self.rng.draws(self.ids, 0, 'spawn', 3)
+        self.pos = spawn[:, :2] * (width, height)
+        angles = spawn[:, 2] * (2 * math.pi)
+        self.move = np.array([(math.cos(angle), math.sin(angle)) for angle in angles]).reshape(count, 2) * velocity
+
+        self.state = np.full(count, WANDERING, dtype=np.int8)
+        self.moving = np.ones(count, dtype=bool)
+        self.left_on_tick = np.full(count, -1, dtype=np.int64)
+
+        self.counter = 0
+        self.recorder = Recorder(record_interval, COUNT_KEYS, COUNTS_SCHEMA)
+        self.stop_reason: str | None = None
+
+    def __len__(self) -> int:
+        return len(self.state)
+
+    def change_positions(self):
+        moving = self.moving
+        direction = normalize_rows(self.move[moving])
+
+        # Bounce off the first wall that's about to be crossed (same order as Cockroach.change_position)
+        ahead = self.pos[moving] + direction * 5
+        flip_x = (ahead[:, 0] < 0) | (ahead[:, 0] > self.width)
+        flip_y = ~flip_x & ((ahead[:, 1] < 0) | (ahead[:, 1] > self.height))
+        direction[flip_x, 0] *= -1
+        direction[flip_y, 1] *= -1
+
+        # Same draws as the 'move' stream of each cockroach: turn check, then x and y of the new direction
+        draws = self.rng.draws(self.ids[moving], self.counter, 'move', 3)
+        turn = draws[:, 0] < 0.005
+        direction[turn] = normalize_rows(-1 + 2 * draws[turn, 1:])
+
+        move = direction * self.velocity
+        self.move[moving] = move
+        self.pos[moving] += move
+
+    def record_states(self, site_ids: np.ndarray) -> dict[str, int]:
+        # Wandering agents are never counted towards a site
+        recorded_sites = np.where(self.state == WANDERING, -1, site_ids)
+        keys = self.state.astype(np.int64) * (len(self.sites) + 1) + (recorded_sites + 1)
+
+        counts = {}
+        for key, count in zip(*np.unique(keys, return_counts=True)):
+            state, site_id = divmod(int(key), len(self.sites) + 1)
+            counts[(STATES[state], site_id - 1)] = int(count)
+            self.recorder.record(self.counter, int(count), state=STATES[state], on_site_id=site_id - 1)
+        return state_populations(counts)
+
+    def update_states(self, site_ids: np.ndarray):
+        state = self.state
+        new_state = state.copy()
+        on_site = site_ids >= 0
+        check = self.counter % self.check_interval == 0
+
+        wandering = state == WANDERING
+        join = state == JOIN
+        still = state == STILL
+        leave = state == LEAVE
+
+        self.moving[wandering | leave] = True
+        self.moving[still] = False
+
+        new_state[wandering & on_site] = JOIN
+        new_state[join & ~on_site] = WANDERING
+
+        if check:
+            deciding = np.flatnonzero(join | still)
+            neighbours = neighbour_counts(self.pos, deciding, self.radius)
+            draws = self.rng.draws(self.ids[deciding], self.counter, 'update')[:, 0]
+
+            joining = state[deciding] == JOIN
+            probability = np.where(joining, join_probability(neighbours), leave_probability(neighbours))
+            decided = deciding[draws < probability]
+
+            joined = decided[state[decided] == JOIN]
+            left = decided[state[decided] == STILL]
+            new_state[joined] = STILL
+            new_state[left] = LEAVE
+            self.left_on_tick[left] = self.counter
+
+        timed_out = leave & (self.counter == self.left_on_tick + LEAVE_TICKS)
+        new_state[timed_out] = WANDERING
+        self.left_on_tick[timed_out] = -1
+
+        self.state = new_state
+
+    def tick(self) -> dict[str, int] | None:
+        # Returns the populations on frames that were recorded
+        self.change_positions()
+
+        populations = None
+        site_ids = self.sites.membership(self.pos)
+        if self.recorder.should_record(self.counter):
+            populations = self.record_states(site_ids)
+
+        self.update_states(site_ids)
+        self.counter += 1
+        return populations
+
+    def counts(self) -> pl.DataFrame:
+        return self.recorder.to_polars()
+
+    def run(self, duration: int, stop_conditions: list[StopCondition] | None = None) -> pl.DataFrame:
+        # Frames 0 up to and including `duration`, like HeadlessSimulation.run,
+        # with the stop conditions checked on every recorded frame
+        self.stop_reason = f'reached the duration of {duration} frames'
+        while self.counter <= duration:
+            frame = self.counter
+            populations = self.tick()
+            if populations is None or frame == duration:
+                continue
+
+            reason = stop_reason(stop_conditions or [], frame, lambda: populations)
+            if reason is not None:
+                self.stop_reason = reason
+                break
+        return self.counts()
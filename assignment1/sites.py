@@ -0,0 +1,28 @@
+import numpy as np
+
+
+class CircleSites:
+    # Sites as plain circles (centre & radius), so membership is arithmetic instead of mask collisions
+    def __init__(self):
+        self.centres = np.empty((0, 2), dtype=np.float64)
+        self.radii = np.empty(0, dtype=np.float64)
+
+    def __len__(self) -> int:
+        return len(self.radii)
+
+    def add(self, x: float, y: float, radius: float) -> int:
+        self.centres = np.vstack([self.centres, [x, y]])
+        self.radii = np.append(self.radii, radius)
+        return len(self.radii) - 1
+
+    def membership(self, positions: np.ndarray) -> np.ndarray:
+        # Site id for every position, or -1 when it's not on any site
+        positions = np.asarray(positions, dtype=np.float64).reshape(-1, 2)
+        if len(self) == 0:
+            return np.full(len(positions), -1, dtype=np.int64)
+
+        diff = positions[:, None, :] - self.centres[None, :, :]
+        inside = np.einsum('ijk,ijk->ij', diff, diff) <= self.radii ** 2
+
+        # Like spritecollideany, the first matching site wins
+        return np.where(inside.any(axis=1), inside.argmax(axis=1), -1)
@@ -1,9 +1,8 @@
 import math
-import random
-from typing import Tuple
+from typing import Tuple, Type
 from pygame.math import Vector2
 from pygame.surface import Surface
-from vi import Agent, ProximityIter, Simulation
+from vi import Agent, Simulation
 
 predatorImages = ['images/foxsmolish.png']
 preyImages = ['images/rabbitsmol.png']
@@ -15,14 +14,71 @@ TIMESTEP_INTERVAL = 6  # 0.1 seconds (assuming 60fps)
 class MyBaseAgent(Agent):
     def __init__(self, images: list[Surface], simulation: Simulation, pos: Vector2 | None = None,
                  move: Vector2 | None = None):
-        super().__init__(images, simulation, pos, move)
+        # Set before vi's __init__, which calls on_spawn
         self.simulation = simulation
+        self.asleep = False
+
+        super().__init__(images, simulation, pos, move)
         
         self.energy = 100
         self.energy_consumption = 0.25
 
         self.ate = self.shared.counter
 
+        if simulation.scheduler is not None:
+            simulation.scheduler.add(self)
+
+    def on_spawn(self):
+        self.simulation.rng.place(self)
+
+    def next_update(self, tick: int) -> int:
+        # update() acts every TIMESTEP_INTERVAL frames and records on the recorder's frames (every frame without one)
+        recorder = self.simulation.recorder
+        if recorder is None:
+            return tick + 1
+        step = math.gcd(TIMESTEP_INTERVAL, recorder.interval)
+        return (tick // step + 1) * step
+
+    def reproduce(self):
+        # Same as vi's reproduce (a new agent with a copy of pos and move), but through the simulation's pool
+        agent = self.simulation.spawn(type(self), self._images)
+        agent.pos = self.pos.copy()
+        agent.move = self.move.copy()
+        return agent
+
+    def kill(self):
+        # Agents can be killed twice in a tick (starved, then eaten), the pool only takes them once
+        pool = self.simulation.pool
+        if pool is not None and self.alive():
+            pool.died(self)
+        super().kill()
+
+        if self.asleep:
+            self.simulation.wake(self)
+
+    def sleep(self):
+        # Asleep agents skip change_position and keep their place in the proximity grid, until wake() is called.
+        # update() still runs (on the ticks the scheduler wakes them for, with scheduled_updates)
+        self.simulation.sleep(self)
+
+    def wake(self):
+        self.simulation.wake(self)
+
+    def neighbours(self, kind: Type[Agent] = Agent) -> list[tuple[Agent, float]]:
+        return self.simulation.neighbours(self, kind)
+
+    def random(self, purpose: str):
+        # This agent's draws for this tick (just the random module unless the simulation uses counter-based draws)
+        return self.simulation.rng.stream(self.id, self.shared.counter, purpose)
+
+    def record(self, **values):
+        recorder = self.simulation.recorder
+        if recorder is None:
+            for column, value in values.items():
+                self.save_data(column, value)
+        elif recorder.should_record(self.shared.counter):
+            recorder.record(self.shared.counter, **values)
+
     def update(self):
         if self.shared.counter % TIMESTEP_INTERVAL == 0:
             self.energy -= self.energy_consumption
@@ -36,12 +92,13 @@ class MyBaseAgent(Agent):
 
         self.there_is_no_escape()
 
+        rng = self.random('move')
         self.direction = self.move.normalize()
 
-        if random.random() < 0.1:
+        if rng.random() < 0.1:
             self.direction = Vector2(
-                random.uniform(self.direction.x - 0.35, self.direction.x + 0.35),
-                random.uniform(self.direction.y - 0.35, self.direction.y + 0.35)
+                rng.uniform(self.direction.x - 0.35, self.direction.x + 0.35),
+                rng.uniform(self.direction.y - 0.35, self.direction.y + 0.35)
             )
             self.direction = self.direction.normalize()
 
@@ -50,10 +107,15 @@ class MyBaseAgent(Agent):
 
 
 class Grass(MyBaseAgent):
+    def __init__(self, images: list[Surface], simulation: Simulation, pos: Vector2 | None = None,
+                 move: Vector2 | None = None):
+        super().__init__(images, simulation, pos, move)
+
+        # Grass never moves
+        self.sleep()
+
     def update(self):
-        self.save_data('type', 'Grass')
-        if hasattr(self.simulation, "seasons"):
-            self.save_data('season', list(self.simulation.seasons.keys())[self.simulation.season_idx])
+        self.record(type='Grass')
 
     def change_position(self):
         pass
@@ -64,23 +126,38 @@ PREY_ENERGY_REGAIN = 15
 PREY_REPRODUCTION_CHANCE = 0.8
 
 class Prey(MyBaseAgent):
+    reproduction_chance = PREY_REPRODUCTION_CHANCE
+
     def update(self):
-        self.save_data('type', 'Prey')
-        if hasattr(self.simulation, "seasons"):
-            self.save_data('season', list(self.simulation.seasons.keys())[self.simulation.season_idx])
+        self.record(type='Prey')
 
         super().update()
 
         # Only perform actions every timestep
         if self.shared.counter % TIMESTEP_INTERVAL == 0:  
+            rng = self.random('update')
             self._reset_ate()
 
-            neighbors = self.in_proximity_accuracy()
+            # Otherwise eating is worked out for all prey at once, see interactions.py
+            if not self.simulation.batched_interactions:
+                self.graze(rng)
+
+    def graze(self, rng):
+        grass = self.simulation.grass
+        if grass is not None:
+            # Eat from the local cell of the grass field
+            if self.ate < 0 and grass.take(self.pos.x, self.pos.y):
+                self.feed()
+
+                if rng.random() < self.reproduction_chance:
+                    self.reproduce()
+        else:
+            neighbors = self.neighbours(Grass)
             for neighbor, distance in neighbors:
                 if self._can_eat(neighbor, distance):
                     self.eat(neighbor)
 
-                    if random.random() < PREY_REPRODUCTION_CHANCE:
+                    if rng.random() < self.reproduction_chance:
                         self.reproduce()
 
     def _reset_ate(self):
@@ -94,54 +171,69 @@ class Prey(MyBaseAgent):
 
     def eat(self, agent):
         agent.kill()
+        self.feed()
+
+    def feed(self):
         self.ate = self.shared.counter
         self.energy = min(100, self.energy + PREY_ENERGY_REGAIN)
 
 
 class Predator(MyBaseAgent):
+    # Chance to spawn another predator after eating
+    reproduction_chance = 0.38  # 0.374
+
     def __init__(self, images: list[Surface], simulation: Simulation, pos: Vector2 | None = None,
                  move: Vector2 | None = None):
         super().__init__(images, simulation, pos, move)
         self.ate = -float('inf')
 
     def update(self):
-        self.save_data('type', 'Predator')
+        self.record(type='Predator')
 
         # Only perform actions every timestep
         if self.shared.counter % TIMESTEP_INTERVAL == 0:
+            rng = self.random('update')
+
             # If predator ate more than 45 frames ago, let it eat again
             if self.shared.counter > self.ate + 30:  # 30
                 self.ate = -float('inf')
 
-            neighbors = self.in_proximity_accuracy()
-            for agent, distance in neighbors:
-                # Check which prey are within eating distance
-                if distance <= EAT_DISTANCE and isinstance(agent, Prey) and self.ate < 0:
-                    agent.kill()
-                    self.ate = self.shared.counter
-
-                    # Chance to spawn another predator after eating
-                    if random.random() < 0.38:  # 0.374
-                        self.reproduce()
-                        # print("ate a mf")
+            if not self.simulation.batched_interactions:
+                self.hunt(rng)
 
             # Chance to die randomly
-            if random.random() < 0.0088:  # 0.0088
+            if rng.random() < 0.0088:  # 0.0088
                 self.kill()
 
+    def hunt(self, rng):
+        neighbors = self.neighbours(Prey)
+        for agent, distance in neighbors:
+            # Check which prey are within eating distance
+            if distance <= EAT_DISTANCE and isinstance(agent, Prey) and self.ate < 0:
+                agent.kill()
+                self.feed()
+
+                if rng.random() < self.reproduction_chance:
+                    self.reproduce()
+                    # print("ate a mf")
+
+    def feed(self):
+        self.ate = self.shared.counter
+
 
 class PredatorWithEnergy(Predator):
+    reproduction_chance = 0.075
+
     def __init__(self, images: list[Surface], simulation: Simulation, pos: Vector2 | None = None,
                  move: Vector2 | None = None):
         super().__init__(images, simulation, pos, move)
 
     def update(self):
-        self.save_data('type', 'Predator')
-        if hasattr(self.simulation, "seasons"):
-            self.save_data('season', list(self.simulation.seasons.keys())[self.simulation.season_idx])
+        self.record(type='Predator')
 
         # Only perform actions every timestep
         if self.shared.counter % TIMESTEP_INTERVAL == 0:
+            rng = self.random('update')
             self.energy -= 0.25
             if self.energy == 0:
                 self.kill()
@@ -150,23 +242,17 @@ class PredatorWithEnergy(Predator):
             if self.shared.counter > self.ate + 30:
                 self.ate = -float('inf')
 
-            neighbors = self.in_proximity_accuracy()
-            for agent, distance in neighbors:
-                # Check which prey are within eating distance
-                if distance <= EAT_DISTANCE and isinstance(agent, Prey) and self.ate < 0:
-                    agent.kill()
-                    self.energy = min(100, self.energy + 30)
-                    self.ate = self.shared.counter
-
-                    # Chance to spawn another predator after eating
-                    if random.random() < 0.075:
-                        self.reproduce()
-                        # print("ate a mf")
+            if not self.simulation.batched_interactions:
+                self.hunt(rng)
 
             # Chance to die randomly
-            if random.random() < self._calculate_death_probability(self.energy):
+            if rng.random() < self._calculate_death_probability(self.energy):
                 self.kill()
 
+    def feed(self):
+        self.energy = min(100, self.energy + 30)
+        self.ate = self.shared.counter
+
     def _calculate_death_probability(self, energy: float) -> float:
         a = 0.1
         prob = math.e ** (-a * energy)
@@ -178,19 +264,20 @@ class PredatorWithEnergy(Predator):
 
         self.there_is_no_escape()
 
+        rng = self.random('move')
         self.direction = self.move.normalize()
 
-        neighbors = self.in_proximity_accuracy()
+        neighbors = self.neighbours(Prey)
         exists, target = self._get_closest_target(neighbors)
         if exists:
             targetDir = (target.pos - self.pos).normalize()
             self.direction += 0.03 * targetDir
             self.direction = self.direction.normalize()
         else:
-            if random.random() < 0.1:
+            if rng.random() < 0.1:
                 self.direction = Vector2(
-                    random.uniform(self.direction.x - 0.35, self.direction.x + 0.35),
-                    random.uniform(self.direction.y - 0.35, self.direction.y + 0.35)
+                    rng.uniform(self.direction.x - 0.35, self.direction.x + 0.35),
+                    rng.uniform(self.direction.y - 0.35, self.direction.y + 0.35)
                 )
                 self.direction = self.direction.normalize()
 
@@ -199,7 +286,7 @@ class PredatorWithEnergy(Predator):
         self.move = self.direction * speed
         self.pos += self.move
 
-    def _get_closest_target(self, neighbors: ProximityIter) -> Tuple[bool, Prey]:
+    def _get_closest_target(self, neighbors: list[tuple[Agent, float]]) -> Tuple[bool, Prey]:
         closestDist = float('inf')
         closestTarget = None
 
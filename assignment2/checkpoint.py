@@ -0,0 +1,183 @@
+import io
+import pickle
+import random
+from collections import defaultdict
+from copy import deepcopy
+from dataclasses import dataclass
+from typing import Any, Type
+
+import numpy as np
+import polars as pl
+from pygame.math import Vector2
+from vi import Agent
+from vi.config import Config
+
+from common.recorder import Recorder, Schema
+from common.scheduler import Scheduler
+from common.stopping import StopCondition
+from pool import AgentPool
+from recorder import FrameRecorder
+from sim import MySimulation
+from sink import SnapshotSink
+
+# Agent attributes that vi sets up on spawn (or caches while rendering), everything else is the agent's own state
+SPAWN_ATTRIBUTES = {'_Sprite__g', '_Agent__simulation', 'id', 'config', 'shared', '_images', '_image_cache',
+                    '_obstacles', '_sites', '_area', 'simulation'}
+
+# Simulation attributes that are set after construction (seasons only exist on MySeasonalSimulation)
+SIMULATION_ATTRIBUTES = ('grow_rate', 'seasons', 'season_idx')
+
+
+@dataclass
+class Checkpoint:
+    # Everything needed to continue a simulation from the frame it was taken on
+    simulation_class: Type[MySimulation]
+    config: Config
+    grass_agent: Type[Agent]
+    grass_field: bool
+    schema: Schema | None
+    stop_conditions: list[StopCondition]
+    stop_interval: int
+    pool_limit: int | None
+    batched_interactions: bool
+    scheduled_updates: bool
+
+    counter: int
+    next_agent_id: int
+    random_state: tuple
+    prng_move_state: tuple
+    rng: Any
+
+    attributes: dict[str, Any]
+    patches: list[tuple[float, float]]
+    grass_counts: np.ndarray | None
+    image_paths: dict[type, list[str]]
+    agents: list[tuple[type, int, dict[str, Any]]]
+
+    # change_position looks at the grid of the previous tick, so it's kept as (class, cell, agent id)
+    proximity: list[tuple[type, tuple[int, int], int]]
+
+    recorder: Recorder | None
+    frame_recorder: FrameRecorder
+    snapshots: bytes
+
+    def save(self, path: str):
+        with open(path, 'wb') as file:
+            pickle.dump(self, file)
+
+    @staticmethod
+    def load(path: str) -> 'Checkpoint':
+        with open(path, 'rb') as file:
+            return pickle.load(file)
+
+    def restore(self, config: Config | None = None, agent_classes: dict[type, type] | None = None,
+                sink: SnapshotSink | None = None) -> MySimulation:
+        # Every restore is an independent fork, nothing mutable is shared with the checkpoint.
+        # agent_classes swaps in variants (e.g. a PredatorWithEnergy subclass with other parameters)
+        agent_classes = agent_classes or {}
+
+        simulation = self.simulation_class(
+            self.grass_agent,
+            config or self.config,
+            deepcopy(self.recorder),
+            sink,
+            self.grass_field,
+            self.schema,
+            deepcopy(self.stop_conditions),
+            self.stop_interval,
+            pool=None if self.pool_limit is None else AgentPool(self.pool_limit),
+            batched_interactions=self.batched_interactions,
+            scheduled_updates=self.scheduled_updates,
+        )
+
+        simulation.rng = deepcopy(self.rng)
+        for name, value in self.attributes.items():
+            setattr(simulation, name, deepcopy(value))
+        simulation.patches = [Vector2(x, y) for x, y in self.patches]
+        if self.grass_counts is not None:
+            simulation.grass.counts = self.grass_counts.copy()
+
+        simulation.frame_recorder = deepcopy(self.frame_recorder)
+        if self.snapshots:
+            simulation._metrics.snapshots = pl.read_ipc(io.BytesIO(self.snapshots))
+
+        # Spawned in the original order, so agents are updated (and draw random numbers) in the same order
+        simulation.image_paths = dict(self.image_paths)
+        images = {cls: simulation._load_images(paths) for cls, paths in self.image_paths.items()}
+        agents = {}
+        for cls, agent_id, state in self.agents:
+            agent = agent_classes.get(cls, cls)(images=images[cls], simulation=simulation,
+                                                pos=state['pos'].copy(), move=state['move'].copy())
+            agent.id = agent_id
+            for name, value in state.items():
+                if name != 'asleep':
+                    setattr(agent, name, deepcopy(value))
+            if state.get('asleep'):
+                simulation.sleep(agent)
+            agents[agent_id] = agent
+
+        # Agents that died after the grid was built are left out, queries skip them anyway
+        simulation._proximity._set_radius(simulation.config.radius)
+        for _, cell, agent_id in self.proximity:
+            if agent_id in agents:
+                agent = agents[agent_id]
+                simulation._proximity._buckets.setdefault(type(agent), defaultdict(list))[cell].append(agent)
+
+        # Agents were scheduled under the ids they got on spawn, they wait for the first tick they act on from here
+        if simulation.scheduler is not None:
+            simulation.scheduler = Scheduler(self.counter - 1)
+            for agent in agents.values():
+                simulation.scheduler.add(agent)
+
+        simulation._next_agent_id = self.next_agent_id
+        simulation.shared.counter = self.counter
+        simulation.shared.prng_move.setstate(self.prng_move_state)
+        simulation._resume_random_state = self.random_state
+
+        return simulation
+
+
+def take_checkpoint(simulation: MySimulation) -> Checkpoint:
+    # Taken between ticks, e.g. after simulation.advance(frames)
+    snapshots = b''
+    if len(simulation._metrics.snapshots) > 0:
+        buffer = io.BytesIO()
+        simulation._metrics.snapshots.write_ipc(buffer)
+        snapshots = buffer.getvalue()
+
+    agents = []
+    for agent in simulation._agents:
+        state = {name: value for name, value in vars(agent).items() if name not in SPAWN_ATTRIBUTES}
+        agents.append((type(agent), agent.id, deepcopy(state)))
+
+    proximity = []
+    for cls, cells in simulation._proximity._buckets.items():
+        for cell, members in cells.items():
+            proximity.extend((cls, cell, agent.id) for agent in members)
+
+    return Checkpoint(
+        simulation_class=type(simulation),
+        config=simulation.config,
+        grass_agent=simulation.grass_agent,
+        grass_field=simulation.grass is not None,
+        schema=simulation.schema,
+        stop_conditions=deepcopy(simulation.stop_conditions),
+        stop_interval=simulation.stop_interval,
+        pool_limit=None if simulation.pool is None else simulation.pool.limit,
+        batched_interactions=simulation.batched_interactions,
+        scheduled_updates=simulation.scheduler is not None,
+        counter=simulation.shared.counter,
+        next_agent_id=simulation._next_agent_id,
+        random_state=simulation._resume_random_state or random.getstate(),
+        prng_move_state=simulation.shared.prng_move.getstate(),
+        rng=deepcopy(simulation.rng),
+        attributes={name: deepcopy(getattr(simulation, name)) for name in SIMULATION_ATTRIBUTES if hasattr(simulation, name)},
+        patches=[(patch.x, patch.y) for patch in simulation.patches],
+        grass_counts=None if simulation.grass is None else simulation.grass.counts.copy(),
+        image_paths=dict(simulation.image_paths),
+        agents=agents,
+        proximity=proximity,
+        recorder=deepcopy(simulation.recorder),
+        frame_recorder=deepcopy(simulation.frame_recorder),
+        snapshots=snapshots,
+    )
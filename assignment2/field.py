@@ -0,0 +1,51 @@
+import math
+
+import numpy as np
+
+from agents import EAT_DISTANCE
+
+# Cells cover about the same area as the circle a prey can eat from
+GRASS_CELL_SIZE = math.ceil(EAT_DISTANCE * math.sqrt(math.pi))
+
+
+class GrassField:
+    # Grass as a count of tufts per grid cell instead of one static agent per tuft
+    def __init__(self, width: int, height: int, cell_size: int = GRASS_CELL_SIZE):
+        self.cell_size = cell_size
+        self.counts = np.zeros((width // cell_size + 1, height // cell_size + 1), dtype=np.int32)
+
+    def _cell(self, x: float, y: float) -> tuple[int, int]:
+        cols, rows = self.counts.shape
+        col = min(max(int(x // self.cell_size), 0), cols - 1)
+        row = min(max(int(y // self.cell_size), 0), rows - 1)
+        return col, row
+
+    def grow(self, x: float, y: float):
+        self.counts[self._cell(x, y)] += 1
+
+    def take(self, x: float, y: float) -> bool:
+        # Eat one tuft from the local cell, if there is any
+        cell = self._cell(x, y)
+        if self.counts[cell] > 0:
+            self.counts[cell] -= 1
+            return True
+        return False
+
+    def take_many(self, x: np.ndarray, y: np.ndarray) -> np.ndarray:
+        # Same as calling take for every position in order: the first ones in a cell get its tufts
+        cols, rows = self.counts.shape
+        col = np.clip((x // self.cell_size).astype(np.int64), 0, cols - 1)
+        row = np.clip((y // self.cell_size).astype(np.int64), 0, rows - 1)
+        cells = col * rows + row
+
+        order = np.argsort(cells, kind='stable')
+        sorted_cells = cells[order]
+        rank = np.empty(len(cells), dtype=np.int64)
+        rank[order] = np.arange(len(cells)) - np.searchsorted(sorted_cells, sorted_cells, side='left')
+
+        eaten = rank < self.counts.ravel()[cells]
+        self.counts -= np.bincount(cells[eaten], minlength=cols * rows).reshape(cols, rows).astype(self.counts.dtype)
+        return eaten
+
+    def total(self) -> int:
+        return int(self.counts.sum())
@@ -0,0 +1,44 @@
+from collections import OrderedDict
+
+import pygame as pg
+from PIL import Image
+from pygame.surface import Surface
+
+IMAGE_CACHE_SIZE = 32
+
+
+class ImageCache:
+    # Path-keyed least-recently-used cache, so every spawned agent shares one surface per image
+    def __init__(self, max_size: int = IMAGE_CACHE_SIZE):
+        self.max_size = max_size
+        self._surfaces: OrderedDict[tuple[str, bool], Surface] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._surfaces)
+
+    def load(self, path: str, decode: bool = True) -> Surface:
+        key = (path, decode)
+        surface = self._surfaces.get(key)
+        if surface is not None:
+            self._surfaces.move_to_end(key)
+            return surface
+
+        if decode:
+            surface = pg.image.load(path)
+        else:
+            # Headless runs only need the size, which PIL reads from the header without decoding
+            with Image.open(path) as img:
+                surface = Surface(img.size)
+
+        self._surfaces[key] = surface
+        if len(self._surfaces) > self.max_size:
+            self._surfaces.popitem(last=False)
+
+        return surface
+
+    def clear(self):
+        self._surfaces.clear()
+
+
+# Shared by every simulation in the process
+IMAGES = ImageCache()
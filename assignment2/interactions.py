@@ -0,0 +1,83 @@
+import numpy as np
+
+from agents import EAT_DISTANCE, Grass, MyBaseAgent, Predator, Prey
+from spatial import pairs_within
+
+
+def positions(agents: list) -> np.ndarray:
+    return np.array([[agent.pos.x, agent.pos.y] for agent in agents], dtype=np.float64).reshape(-1, 2)
+
+
+def match(eaters: np.ndarray, foods: np.ndarray, distances: np.ndarray, eater_ids: np.ndarray,
+          food_ids: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # At most one food per eater and one eater per food. Every free eater goes for its closest free food and
+    # every food goes to the closest of those eaters (ties to the lowest ids), repeated until nothing changes
+    order = np.lexsort((food_ids[foods], eater_ids[eaters], distances))
+    eaters, foods = eaters[order], foods[order]
+
+    eater_done = np.zeros(len(eater_ids), dtype=bool)
+    food_done = np.zeros(len(food_ids), dtype=bool)
+    matched_eaters, matched_foods = [], []
+    while True:
+        free = ~eater_done[eaters] & ~food_done[foods]
+        if not free.any():
+            break
+        eaters, foods = eaters[free], foods[free]
+
+        # Pairs are sorted closest first, so the first pair of an eater is its choice
+        _, first = np.unique(eaters, return_index=True)
+        choices = np.sort(first)
+        _, accepted = np.unique(foods[choices], return_index=True)
+        accepted = choices[accepted]
+
+        eater_done[eaters[accepted]] = True
+        food_done[foods[accepted]] = True
+        matched_eaters.append(eaters[accepted])
+        matched_foods.append(foods[accepted])
+
+    if not matched_eaters:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(matched_eaters), np.concatenate(matched_foods)
+
+
+def hunt(eaters: list[MyBaseAgent], foods: list[MyBaseAgent], inclusive: bool) -> list[MyBaseAgent]:
+    # Eaters that caught something, the food is killed
+    pairs_eaters, pairs_foods, distances = pairs_within(positions(eaters), positions(foods), EAT_DISTANCE, inclusive)
+    eater_ids = np.array([agent.id for agent in eaters], dtype=np.int64)
+    food_ids = np.array([agent.id for agent in foods], dtype=np.int64)
+    matched_eaters, matched_foods = match(pairs_eaters, pairs_foods, distances, eater_ids, food_ids)
+
+    for index in matched_foods:
+        foods[index].kill()
+    return [eaters[index] for index in np.sort(matched_eaters)]
+
+
+def resolve_interactions(simulation):
+    # All eating of one timestep at once, after every agent has updated (and reset its `ate` cooldown).
+    # Predators hunt first, then the prey that are left graze
+    agents = sorted(simulation._agents, key=lambda agent: agent.id)
+    predators = [agent for agent in agents if isinstance(agent, Predator) and agent.ate < 0]
+    prey = [agent for agent in agents if isinstance(agent, Prey)]
+
+    fed = hunt(predators, prey, inclusive=True)
+    hungry_prey = [agent for agent in prey if agent.alive() and agent.ate < 0]
+
+    if simulation.grass is not None:
+        spots = positions(hungry_prey)
+        eaten = simulation.grass.take_many(spots[:, 0], spots[:, 1])
+        fed += [agent for agent, ate in zip(hungry_prey, eaten) if ate]
+    else:
+        grass = [agent for agent in agents if isinstance(agent, Grass)]
+        fed += hunt(hungry_prey, grass, inclusive=False)
+
+    for agent in fed:
+        agent.feed()
+
+    # Reproduction rolls for everyone that ate, in id order so the new agents get the same ids every run
+    fed.sort(key=lambda agent: agent.id)
+    ids = np.array([agent.id for agent in fed], dtype=np.int64)
+    rolls = simulation.rng.draws(ids, simulation.shared.counter, 'eat')[:, 0]
+    chances = np.array([agent.reproduction_chance for agent in fed])
+    for agent, reproduces in zip(fed, rolls < chances):
+        if reproduces:
+            agent.reproduce()
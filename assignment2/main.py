@@ -1,18 +1,31 @@
 from vi import Window, Config
+from common.recorder import Recorder
+from common.stopping import Extinction, MaxAgents, StopCondition
 from sim import MySimulation, MySeasonalSimulation, MyConfig, SEASON_LENGTH
-from agents import Predator, PredatorWithEnergy, Prey, predatorImages, preyImages, TIMESTEP_INTERVAL, Grass
-from plotting import plot_population_sizes, plot_population_sizes_with_seasons, print_avg_pop_size_per_season
+from agents import PredatorWithEnergy, Prey, predatorImages, preyImages, TIMESTEP_INTERVAL, Grass
+from plotting import population_table, plot_population_sizes_with_seasons, print_avg_pop_size_per_season
+from pool import AgentPool
+from profiling import PhaseTimer
 
+# Predators can't outlive the prey, and past this many agents a run slows to a crawl
+MAX_AGENTS = 5000
 
-def run_grass_only_simulation():
-    window = Window(750, 750)
+def default_stop_conditions() -> list[StopCondition]:
+    # Opt-in early stopping, e.g. run_seasonal_simulation(stop_conditions=default_stop_conditions()).
+    # Without it the runs go on for their whole duration
+    return [Extinction(['Prey']), MaxAgents(MAX_AGENTS, ['Prey', 'Predator'])]
 
-    config = MyConfig()
 
-    # GOOD SEED: 472220471
-    # This shit lowkey just runs infinitely I stg: 114300533
-    metrics = (
-        MySimulation(
+def build_simulation(seed: int, duration: int, seasonal: bool = False, grass_field: bool = False,
+                     predators: int = 20, prey: int = 150, stop_conditions: list[StopCondition] | None = None,
+                     counter_rng: bool = False, timer: PhaseTimer | None = None,
+                     pool: AgentPool | None = None, batched_interactions: bool = False,
+                     scheduled_updates: bool = False) -> MySimulation:
+    window = Window(750, 750)
+
+    simulation_class = MySeasonalSimulation if seasonal else MySimulation
+    return (
+        simulation_class(
             Grass,
             Config(
                 window=window,
@@ -20,49 +33,49 @@ def run_grass_only_simulation():
                 fps_limit=144,
                 print_fps=False,
                 radius=25,
-                seed=config.seed,
-                duration=36000
-            )
+                seed=seed,
+                duration=duration
+            ),
+            Recorder(TIMESTEP_INTERVAL, ('type',)),
+            grass_field=grass_field,
+            stop_conditions=stop_conditions,
+            counter_rng=counter_rng,
+            timer=timer,
+            pool=pool,
+            batched_interactions=batched_interactions,
+            scheduled_updates=scheduled_updates
         )
         .spawn_grass_patches(5, 10, 'images/circle_resized.png')
-        .batch_spawn_agents(20, PredatorWithEnergy, predatorImages)
-        .batch_spawn_agents(150, Prey, preyImages)
-        .run()
+        .batch_spawn_agents(predators, PredatorWithEnergy, predatorImages)
+        .batch_spawn_agents(prey, Prey, preyImages)
     )
 
+def run_grass_only_simulation(grass_field: bool = False, stop_conditions: list[StopCondition] | None = None):
+    config = MyConfig()
+
+    # GOOD SEED: 472220471
+    # This shit lowkey just runs infinitely I stg: 114300533
+    metrics = build_simulation(config.seed, 36000, grass_field=grass_field, stop_conditions=stop_conditions).run()
+
     return metrics
 
-def run_seasonal_simulation():
+def run_seasonal_simulation(grass_field: bool = False, stop_conditions: list[StopCondition] | None = None):
     # Good seed: 630358656
-    window = Window(750, 750)
-
     config = MyConfig()
 
-    metrics = (
-        MySeasonalSimulation(
-            Grass,
-            Config(
-                window=window,
-                image_rotation=True,
-                fps_limit=144,
-                print_fps=False,
-                radius=25,
-                seed=config.seed,
-                duration=SEASON_LENGTH * 4
-            )
-        )
-        .spawn_grass_patches(5, 10, 'images/circle_resized.png')
-        .batch_spawn_agents(20, PredatorWithEnergy, predatorImages)
-        .batch_spawn_agents(150, Prey, preyImages)
-        .run()
-    )
+    metrics = build_simulation(config.seed, SEASON_LENGTH * 4, seasonal=True, grass_field=grass_field,
+                               stop_conditions=stop_conditions).run()
 
     return metrics
 
 
 if __name__ == '__main__':
     metrics = run_seasonal_simulation()
+    print(f'Stopped: {metrics.stop_reason}')
+
+    # Scan the snapshots once and derive every output from the same table
+    populations = population_table(metrics.snapshots, TIMESTEP_INTERVAL, metrics.frames)
 
-    print_avg_pop_size_per_season(metrics.snapshots, TIMESTEP_INTERVAL)
-    plot_population_sizes_with_seasons(metrics.snapshots, TIMESTEP_INTERVAL, SEASON_LENGTH)
+    print_avg_pop_size_per_season(populations)
+    plot_population_sizes_with_seasons(populations, SEASON_LENGTH)
  
\ No newline at end of file
@@ -2,36 +2,51 @@ import polars as pl
 import numpy as np
 import matplotlib.pyplot as plt
 
-def plot_population_sizes(snapshots: pl.DataFrame, timestep_frame_interval: int) -> None:
-    # Drop unneeded columns
-    df = snapshots.drop(['x', 'y', 'image_index', 'angle'])
-    df = df.filter((pl.col('frame') % timestep_frame_interval == 0))
-
-    # Remove rows that do not coincide with our timesteps
-    timesteps = df.groupby('frame', maintain_order=True).agg(pl.count('*'))['frame'].to_list()
-    arr = np.arange(0, max(timesteps) + 1, step=timestep_frame_interval)
-    arr = arr.astype(np.int64)
-    frame_range = pl.DataFrame({'frame': arr})
-    print(frame_range)
-
-    # Calculate x values in seconds 
-    # TODO: Fix bug where timesteps and x_values are out of sync by 1 increment
-    step = timestep_frame_interval / 60
-    stop = 0 + (len(timesteps) * step)
-    x_values = np.arange(0, stop, step)
-    print(x_values)
-
-    grouped = df.groupby(['frame', 'type'], maintain_order=True).agg(pl.count('id').alias('count'))
-    
-    df_prey = grouped.filter((pl.col('type') == 'Prey')).drop('type')
-    df_predator = grouped.filter((pl.col('type') == 'Predator')).drop('type')
-
-    # Pad dfs with 0s where there are no agents alive
-    df_prey_padded = frame_range.join(df_prey, on='frame', how='left').fill_null(0)
-    df_predator_padded = frame_range.join(df_predator, on='frame', how='left').fill_null(0)
-
-    prey_values = df_prey_padded['count'].to_list()
-    predator_values = df_predator_padded['count'].to_list()
+SPECIES = ['Prey', 'Predator', 'Grass']
+
+def population_table(snapshots: pl.DataFrame | pl.LazyFrame, timestep_frame_interval: int, frames: pl.DataFrame | None = None) -> pl.DataFrame:
+    # One lazy scan over the snapshots (in memory, from a Recorder or from a SnapshotSink)
+    df = snapshots.lazy().filter((pl.col('frame') % timestep_frame_interval == 0))
+
+    # Snapshots from a Recorder are already counted, raw snapshots still have a row per agent
+    if 'count' in df.columns:
+        count = pl.sum('count').alias('count')
+    else:
+        count = pl.count('id').alias('count')
+
+    index = ['frame', 'season'] if 'season' in df.columns else ['frame']
+    counts = df.groupby([*index, 'type']).agg(count).collect()
+
+    # Wide frame x species (x season) table
+    wide = counts.pivot(values='count', index=index, columns='type', aggregate_function='sum')
+    for species in SPECIES:
+        if species not in wide.columns:
+            wide = wide.with_columns(pl.lit(0).alias(species))
+
+    # Pad with 0s where there are no agents alive at all
+    last_frame = wide['frame'].max() if len(wide) > 0 else 0
+    frame_range = pl.DataFrame({'frame': np.arange(0, last_frame + 1, step=timestep_frame_interval, dtype=np.int64)})
+    table = frame_range.join(wide.with_columns(pl.col('frame').cast(pl.Int64)), on='frame', how='left')
+    table = table.with_columns([pl.col(species).fill_null(0).cast(pl.Int64) for species in SPECIES])
+
+    if 'season' in index:
+        table = table.with_columns(pl.col('season').fill_null(strategy='forward'))
+    elif frames is not None and 'season' in frames.columns:
+        # Seasons come from the frame-level table, joined once per frame instead of stored per agent
+        table = table.join(frames.select(['frame', 'season']), on='frame', how='left')
+        index = ['frame', 'season']
+
+    return table.select([*index, *SPECIES])
+
+def time_values(populations: pl.DataFrame) -> np.ndarray:
+    # Frames to seconds (assuming 60fps)
+    return populations['frame'].to_numpy() / 60
+
+def plot_population_sizes(populations: pl.DataFrame) -> None:
+    x_values = time_values(populations)
+
+    prey_values = populations['Prey'].to_list()
+    predator_values = populations['Predator'].to_list()
 
     # Plots
     plt.clf()
@@ -46,39 +61,12 @@ def plot_population_sizes(snapshots: pl.DataFrame, timestep_frame_interval: int)
 
     plt.show()
 
-def plot_population_sizes_with_seasons(snapshots: pl.DataFrame, timestep_frame_interval: int, season_length: int) -> None:
-    # Drop unneeded columns
-    df = snapshots.drop(['x', 'y', 'image_index', 'angle'])
-    df = df.filter((pl.col('frame') % timestep_frame_interval == 0))
-
-    # Remove rows that do not coincide with our timesteps
-    timesteps = df.groupby('frame', maintain_order=True).agg(pl.count('*'))['frame'].to_list()
-    arr = np.arange(0, max(timesteps) + 1, step=timestep_frame_interval)
-    arr = arr.astype(np.int64)
-    frame_range = pl.DataFrame({'frame': arr})
-    # print(frame_range)
-
-    # Calculate x values in seconds 
-    # TODO: Fix bug where timesteps and x_values are out of sync by 1 increment
-    step = timestep_frame_interval / 60
-    stop = 0 + (len(timesteps) * step)
-    x_values = np.arange(0, stop, step)
-    # print(x_values)
-
-    grouped = df.groupby(['frame', 'type'], maintain_order=True).agg(pl.count('id').alias('count'))
-    
-    df_prey = grouped.filter((pl.col('type') == 'Prey')).drop('type')
-    df_predator = grouped.filter((pl.col('type') == 'Predator')).drop('type')
-    df_grass = grouped.filter((pl.col('type') == 'Grass')).drop('type')
-
-    # Pad dfs with 0s where there are no agents alive
-    df_prey_padded = frame_range.join(df_prey, on='frame', how='left').fill_null(0)
-    df_predator_padded = frame_range.join(df_predator, on='frame', how='left').fill_null(0)
-    df_grass_padded =frame_range.join(df_grass, on='frame', how='left').fill_null(0)
-
-    prey_values = df_prey_padded['count'].to_list()
-    predator_values = df_predator_padded['count'].to_list()
-    grass_values = df_grass_padded['count'].to_list()
+def plot_population_sizes_with_seasons(populations: pl.DataFrame, season_length: int) -> None:
+    x_values = time_values(populations)
+
+    prey_values = populations['Prey'].to_list()
+    predator_values = populations['Predator'].to_list()
+    grass_values = populations['Grass'].to_list()
 
     # Get x_vales where season changed
     season_time = season_length / 60
@@ -111,30 +99,15 @@ def plot_population_sizes_with_seasons(snapshots: pl.DataFrame, timestep_frame_i
 
     plt.show()
 
-def print_avg_pop_size_per_season(snapshots: pl.DataFrame, timestep_frame_interval: int) -> None:
-    df = snapshots.drop(['x', 'y', 'image_index', 'angle'])
-    df = df.filter((pl.col('frame') % timestep_frame_interval == 0))
-    
-    grouped = df.groupby(['frame', 'type', 'season'], maintain_order=True).agg(pl.count('id').alias('count'))
-    
-    timesteps = df.groupby('frame', maintain_order=True).agg(pl.count('*'))['frame'].to_list()
-    arr = np.arange(0, max(timesteps) + 1, step=timestep_frame_interval)
-    arr = arr.astype(np.int64)
-    frame_range = pl.DataFrame({'frame': arr})
-
-    df_prey = grouped.filter((pl.col('type') == 'Prey'))
-    df_predator = grouped.filter((pl.col('type') == 'Predator'))
-    df_grass = grouped.filter((pl.col('type') == 'Grass'))
-
-    df_prey_padded = frame_range.join(df_prey, on='frame', how='left').fill_null(0)
-    df_predator_padded = frame_range.join(df_predator, on='frame', how='left').fill_null(0)
-    df_grass_padded =frame_range.join(df_grass, on='frame', how='left').fill_null(0)
-
-    combined = pl.concat([df_prey_padded, df_predator_padded, df_grass_padded]).sort('frame')
-
-    grouped_means = combined.groupby(['type', 'season']).agg(pl.mean('count').alias('mean'))
-    
+def print_avg_pop_size_per_season(populations: pl.DataFrame) -> None:
+    grouped_means = (
+        populations
+        .groupby('season')
+        .agg([pl.mean(species) for species in SPECIES])
+        .melt(id_vars='season', value_vars=SPECIES, variable_name='type', value_name='mean')
+        .select(['type', 'season', 'mean'])
+    )
+
     pl.Config.set_tbl_rows(20)
     means_sorted = grouped_means.sort(["season", "type"])
     print(means_sorted)
-    
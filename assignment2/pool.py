@@ -0,0 +1,51 @@
+from collections import defaultdict
+from typing import Type
+
+from vi import Agent
+
+# Dead agents kept per class, more than this are left to the garbage collector
+POOL_LIMIT = 10_000
+
+
+class AgentPool:
+    # Free list of dead agents. Births (reproduce, grass growth) reuse one of the same class instead of building
+    # a new object, so boom/bust cycles don't keep allocating (and collecting) agents.
+    # A killed agent can still be handed out by the proximity grid of its tick, so it's only free to reuse
+    # once the grid has been rebuilt without it
+    def __init__(self, limit: int = POOL_LIMIT):
+        self.limit = limit
+        self.created = 0
+        self.reused = 0
+
+        self._dying: list[Agent] = []
+        self._free: defaultdict[type, list[Agent]] = defaultdict(list)
+
+    def __len__(self) -> int:
+        return sum(len(agents) for agents in self._free.values())
+
+    def died(self, agent: Agent):
+        self._dying.append(agent)
+
+    def release(self):
+        # Called right after the proximity grid is rebuilt
+        for agent in self._dying:
+            free = self._free[type(agent)]
+            if len(free) < self.limit:
+                # __init__ sets every field again, except that vi only picks a spawn position when there's none
+                # and keeps the image it rendered this frame
+                del agent.pos
+                agent._image_cache = None
+                free.append(agent)
+        self._dying.clear()
+
+    def spawn(self, cls: Type[Agent], images: list, simulation, pos=None) -> Agent:
+        free = self._free.get(cls)
+        if not free:
+            self.created += 1
+            return cls(images=images, simulation=simulation, pos=pos)
+
+        # Same steps (and the same draws from vi's generator) as building a new agent
+        agent = free.pop()
+        cls.__init__(agent, images=images, simulation=simulation, pos=pos)
+        self.reused += 1
+        return agent
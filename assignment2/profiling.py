@@ -0,0 +1,73 @@
+from collections import defaultdict
+from time import perf_counter
+
+import polars as pl
+
+# Neighbour queries run inside change_position and update, so their time is also part of those phases
+QUERIES = 'neighbour_queries'
+
+
+class NoTimer:
+    # Default: nothing is timed, agents are just called
+    enabled = False
+    per_class = False
+
+    def start(self, frame: int):
+        pass
+
+    def lap(self, phase: str):
+        pass
+
+    def add(self, column: str, seconds: float):
+        pass
+
+    def each(self, method: str, agents: list):
+        for agent in agents:
+            getattr(agent, method)()
+
+    def to_polars(self) -> pl.DataFrame:
+        return pl.DataFrame()
+
+
+class PhaseTimer(NoTimer):
+    # Seconds spent in every phase of the tick, one row per frame.
+    # With per_class, change_position and update are also split up per agent class ('update:Prey', ...)
+    enabled = True
+
+    def __init__(self, per_class: bool = False):
+        self.per_class = per_class
+        self._rows: list[defaultdict[str, float]] = []
+        self._frames: list[int] = []
+        self._last = 0.0
+
+    def start(self, frame: int):
+        self._frames.append(frame)
+        self._rows.append(defaultdict(float))
+        self._last = perf_counter()
+
+    def lap(self, phase: str):
+        # Time since the previous lap goes to this phase
+        now = perf_counter()
+        self._rows[-1][phase] += now - self._last
+        self._last = now
+
+    def add(self, column: str, seconds: float):
+        self._rows[-1][column] += seconds
+
+    def each(self, method: str, agents: list):
+        if not self.per_class:
+            super().each(method, agents)
+            return
+
+        row = self._rows[-1]
+        for agent in agents:
+            start = perf_counter()
+            getattr(agent, method)()
+            row[f'{method}:{type(agent).__name__}'] += perf_counter() - start
+
+    def to_polars(self) -> pl.DataFrame:
+        columns = sorted({column for row in self._rows for column in row})
+        data = {'frame': pl.Series(self._frames, dtype=pl.Int64)}
+        for column in columns:
+            data[column] = pl.Series([row.get(column, 0.0) for row in self._rows], dtype=pl.Float64)
+        return pl.DataFrame(data)
@@ -0,0 +1,51 @@
+from collections import defaultdict
+from typing import Any
+
+import polars as pl
+from vi.metrics import Metrics
+
+from common.recorder import Schema
+
+# Columns that Agent._collect_replay_data fills in on its own
+REPLAY_COLUMNS = ('x', 'y', 'image_index', 'angle')
+
+
+# Only what the plots use: frame, id & type, with narrow ints and a categorical type
+SNAPSHOT_SCHEMA = Schema(
+    dtypes={'frame': pl.Int32, 'id': pl.Int32, 'type': pl.Categorical},
+    exclude=REPLAY_COLUMNS,
+)
+
+
+class FrameRecorder:
+    # One row per frame for simulation-wide values (season, grow_rate, ...),
+    # joined onto the agent rows only when they're needed
+    def __init__(self, interval: int = 1):
+        self.interval = interval
+        self._columns: defaultdict[str, list[Any]] = defaultdict(list)
+
+    def record(self, frame: int, **values: Any):
+        if frame % self.interval != 0:
+            return
+
+        self._columns['frame'].append(frame)
+        for column, value in values.items():
+            self._columns[column].append(value)
+
+    def to_polars(self) -> pl.DataFrame:
+        if not self._columns:
+            return pl.DataFrame({'frame': pl.Series([], dtype=pl.Int64)})
+        return pl.from_dict(self._columns).with_columns(pl.col('frame').cast(pl.Int64))
+
+
+class SimulationMetrics(Metrics):
+    # Metrics with the FrameRecorder table and the per-phase timings next to the snapshots, and why the run ended
+    frames: pl.DataFrame
+    timings: pl.DataFrame
+    stop_reason: str | None
+
+    def __init__(self):
+        super().__init__()
+        self.frames = pl.DataFrame()
+        self.timings = pl.DataFrame()
+        self.stop_reason = None
@@ -0,0 +1,62 @@
+import random
+import sys
+from dataclasses import dataclass
+from multiprocessing import Pool
+
+from common.stopping import Extinction
+from main import build_simulation
+from sim import SEASON_LENGTH
+
+
+@dataclass
+class Replica:
+    seed: int
+    duration: int = 36000
+    seasonal: bool = False
+    # Same model main.py runs by default, seeds ranked on the grass field wouldn't carry over to Grass agents
+    grass_field: bool = False
+    predators: int = 20
+    prey: int = 150
+    counter_rng: bool = False
+
+
+@dataclass
+class ReplicaResult:
+    replica: Replica
+    # Frames the prey and predators lived side by side (the full duration if neither died out)
+    coexistence: int
+    prey: int
+    predators: int
+    stop_reason: str
+
+
+def run_replica(replica: Replica) -> ReplicaResult:
+    simulation = build_simulation(replica.seed, replica.duration, replica.seasonal, replica.grass_field,
+                                  replica.predators, replica.prey, [Extinction(['Prey', 'Predator'])],
+                                  replica.counter_rng)
+    metrics = simulation.run()
+
+    populations = simulation.populations()
+    return ReplicaResult(replica, simulation.shared.counter, populations['Prey'], populations['Predator'], metrics.stop_reason)
+
+
+def search_seeds(replicas: list[Replica], processes: int | None = None) -> list[ReplicaResult]:
+    # Replicas are independent and stop as soon as a species dies out,
+    # so bad seeds free up their worker early for the next one
+    with Pool(processes) as pool:
+        results = list(pool.imap_unordered(run_replica, replicas))
+
+    # Ties (usually runs that lasted the full duration) go to the run furthest from dying out
+    return sorted(results, key=lambda result: (result.coexistence, min(result.prey, result.predators)), reverse=True)
+
+
+def random_replicas(count: int, **kwargs) -> list[Replica]:
+    return [Replica(random.randint(0, 999999999), **kwargs) for _ in range(count)]
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 32
+
+    results = search_seeds(random_replicas(count, duration=SEASON_LENGTH * 4, seasonal=True))
+    for result in results[:10]:
+        print(f'seed {result.replica.seed}: {result.coexistence} frames, {result.prey} prey, {result.predators} predators')
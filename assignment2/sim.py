@@ -1,20 +1,38 @@
 import math
 import random
+from collections import defaultdict
+from time import perf_counter
 from PIL import Image
-from typing import Optional, Type
+from typing import Type
 import pygame as pg
 from pygame import Vector2
-from vi import HeadlessSimulation, Simulation
+from vi import Agent, HeadlessSimulation
 from vi.config import Config, dataclass, deserialize
-from vi.metrics import Metrics
 
+from common.recorder import Recorder, Schema
+from common.scheduler import Scheduler
+from common.stopping import StopCondition, stop_reason
+from common.streams import CounterRandom, GlobalRandom
+from agents import Predator, Prey, TIMESTEP_INTERVAL
+from field import GrassField
+from images import IMAGES
+from interactions import resolve_interactions
+from recorder import FrameRecorder, SimulationMetrics
+from pool import AgentPool
+from sink import SnapshotSink
+from spatial import TypedProximityEngine
+from profiling import NoTimer, PhaseTimer, QUERIES
 
-def perturb_point_within_radius(x, y, radius):
+# Agent id used for the simulation's own draws (grass growth, patch placement)
+SIMULATION_ID = -1
+
+
+def perturb_point_within_radius(x, y, radius, rng=random):
 # Generate a random angle in radians
-    angle = random.uniform(0, 2 * math.pi)
+    angle = rng.uniform(0, 2 * math.pi)
     
     # Generate a random distance within the radius
-    distance = random.uniform(0, radius)
+    distance = rng.uniform(0, radius)
     
     # Calculate the new perturbed point
     new_x = x + distance * math.cos(angle)
@@ -37,25 +55,269 @@ GROW_RATE = 0.018 # 0.025
 GROW_RADIUS = 70
 
 class MySimulation(HeadlessSimulation):
-    def __init__(self, grass_agent, config: Config | None = None):
+    def __init__(self, grass_agent, config: Config | None = None, recorder: Recorder | None = None,
+                 sink: SnapshotSink | None = None, grass_field: bool = False, schema: Schema | None = None,
+                 stop_conditions: list[StopCondition] | None = None, stop_interval: int = TIMESTEP_INTERVAL,
+                 counter_rng: bool = False, timer: PhaseTimer | None = None, pool: AgentPool | None = None,
+                 batched_interactions: bool = False, scheduled_updates: bool = False):
         super().__init__(config)
+        self._metrics = SimulationMetrics()
+
+        # Counter-based draws keyed by (seed, agent id, tick, purpose) don't depend on the order agents update in
+        self.rng = CounterRandom(self.config.seed) if counter_rng else GlobalRandom()
         self.grass_agent = grass_agent
         self.grow_rate = GROW_RATE
 
+        # Simulation-wide values are recorded once per frame instead of on every agent row
+        self.frame_recorder = FrameRecorder()
+
+        # Grass as tufts per grid cell instead of Grass agents, counts only show up through a recorder
+        self.grass: GrassField | None = None
+        if grass_field:
+            if recorder is None:
+                raise ValueError("The grass field is only counted by a Recorder, pass one to the simulation")
+            self.grass = GrassField(*self.config.window.as_tuple())
+
+        # With a recorder, agents add to its running counts and no per-agent snapshots are kept
+        self.recorder = recorder
+
+        # With a sink, snapshots are streamed to disk instead of being kept in metrics.snapshots
+        self.sink = sink
+
+        # With a schema, snapshots only keep its columns and are cast to its dtypes.
+        # Categorical columns are stacked as strings every tick and only made categorical once run() ends,
+        # chunks with categories of their own can't be stacked without a global string cache
+        self.schema = schema
+
+        # Checked every `stop_interval` frames, the run ends early with the reason of the first one that triggers
+        self.stop_conditions = stop_conditions or []
+        self.stop_interval = stop_interval
+        self.stop_reason: str | None = None
+
+        self._proximity = TypedProximityEngine(self._agents, self.config.radius)
+
+        # Per-phase timings of every tick, exported as metrics.timings
+        self.timer = timer or NoTimer()
+
+        # Eating and predation of a whole timestep resolved at once after the updates (see interactions.py),
+        # instead of inside every agent's update where the update order decides who gets contested food
+        self.batched_interactions = batched_interactions
+
+        # Agents are only updated on the ticks they act on (see common/scheduler.py) instead of every frame
+        self.scheduler = Scheduler() if scheduled_updates else None
+
+        # With a pool, dead agents are reused for births instead of building new ones
+        self.pool = pool
+
+        # Image paths per agent class, so a checkpoint can spawn the agents again
+        self.image_paths: dict[type, list[str]] = {}
+
+        # Set when restored from a checkpoint, the global random state is only put back once the run starts
+        self._resume_random_state: tuple | None = None
+
+    def neighbours(self, agent: Agent, kind: Type[Agent] = Agent) -> list[tuple[Agent, float]]:
+        # A fresh query every time: change_position and update() each ask once per agent, against different grids.
+        # Agents eaten earlier this tick are already skipped by the query
+        if not self.timer.enabled:
+            return self._proximity.in_proximity_of(agent, kind)
+
+        start = perf_counter()
+        neighbours = self._proximity.in_proximity_of(agent, kind)
+        self.timer.add(QUERIES, perf_counter() - start)
+        return neighbours
+
+    def sleep(self, agent: Agent):
+        if not agent.asleep:
+            agent.asleep = True
+            self._proximity.add_static(agent)
+
+    def wake(self, agent: Agent):
+        if agent.asleep:
+            agent.asleep = False
+            self._proximity.remove_static(agent)
+            if agent.alive():
+                self._proximity.add(agent)
+
+    def populations(self) -> dict[str, int]:
+        species = {'Prey': Prey, 'Predator': Predator, 'Grass': self.grass_agent}
+
+        counts = dict.fromkeys(species, 0)
+        for agent in self._agents:
+            for name, kind in species.items():
+                if isinstance(agent, kind):
+                    counts[name] += 1
+                    break
+
+        if self.grass is not None:
+            counts['Grass'] = self.grass.total()
+        return counts
+
+    def spawn(self, agent_class, images: list[pg.surface.Surface], pos: Vector2 | None = None) -> Agent:
+        if self.pool is None:
+            return agent_class(images=images, simulation=self, pos=pos)
+        return self.pool.spawn(agent_class, images, self, pos)
+
     def spawn_agent(self, agent_class, images, pos_x, pos_y):
-        
-        agent_class(images=self._load_images(images), simulation=self, pos=Vector2(pos_x, pos_y))
+        self.image_paths[agent_class] = images
+        self.spawn(agent_class, self._load_images(images), Vector2(pos_x, pos_y))
 
         return self
 
+    def batch_spawn_agents(self, count, agent_class, images):
+        self.image_paths[agent_class] = images
+        return super().batch_spawn_agents(count, agent_class, images)
+
+    def _load_image(self, path: str) -> pg.surface.Surface:
+        # Nothing is drawn in a headless run, so the image is never decoded
+        return IMAGES.load(path, decode=False)
+
+    def spawn_grass(self, x, y):
+        if self.grass is not None:
+            self.grass.grow(x, y)
+        else:
+            self.spawn_agent(self.grass_agent, ['images/grass_icon.png'], x, y)
+
+    def frame_data(self) -> dict:
+        return {'grow_rate': self.grow_rate}
+
+    def record_grass(self):
+        if self.grass is not None and self.recorder.should_record(self.shared.counter):
+            self.recorder.record(self.shared.counter, count=self.grass.total(), type='Grass')
+
     def before_update(self):
         super().before_update()
 
+        rng = self.rng.stream(SIMULATION_ID, self.shared.counter, 'grow')
         for i, pos in enumerate(self.patches):
-            if random.random() < self.grow_rate:
-                x, y = perturb_point_within_radius(pos.x, pos.y, GROW_RADIUS)
-                self.spawn_agent(self.grass_agent, ['images/grass_icon.png'], x, y)
-        
+            if rng.random() < self.grow_rate:
+                x, y = perturb_point_within_radius(pos.x, pos.y, GROW_RADIUS, rng)
+                self.spawn_grass(x, y)
+
+    def collect_snapshots(self):
+        if self.schema is None:
+            for agent in self._agents.sprites():
+                agent._collect_replay_data()
+            return
+
+        # Like Agent._collect_replay_data, minus the columns the schema leaves out
+        snapshots = self._metrics._temporary_snapshots
+        frame = self.shared.counter
+        keep_position = self.schema.keeps('x') or self.schema.keeps('y')
+        keep_image = self.schema.keeps('image_index')
+        keep_angle = self.config.image_rotation and self.schema.keeps('angle')
+
+        for agent in self._agents.sprites():
+            snapshots['frame'].append(frame)
+            snapshots['id'].append(agent.id)
+            if keep_position:
+                x, y = agent.center
+                if self.schema.keeps('x'):
+                    snapshots['x'].append(x)
+                if self.schema.keeps('y'):
+                    snapshots['y'].append(y)
+            if keep_image:
+                snapshots['image_index'].append(agent._image_index)
+            if keep_angle:
+                snapshots['angle'].append(round(agent.move.angle_to(Vector2((0, -1)))))
+
+    def tick(self):
+        # Same order as HeadlessSimulation.tick, minus the snapshots when a recorder is used
+        timer = self.timer
+        timer.start(self.shared.counter)
+
+        self.before_update()
+        self.frame_recorder.record(self.shared.counter, **self.frame_data())
+        timer.lap('before_update')
+
+        # Asleep agents don't move, so they're neither moved nor indexed again
+        awake = [agent for agent in self._agents.sprites() if not agent.asleep]
+        timer.each('change_position', awake)
+        timer.lap('change_position')
+
+        self._proximity._set_radius(self.config.radius)
+        self._proximity.update(awake)
+        if self.pool is not None:
+            self.pool.release()
+        timer.lap('proximity')
+
+        if self.recorder is None:
+            self.collect_snapshots()
+
+        # Counted before the prey eat, like Grass agents that record at the start of their update
+        self.record_grass()
+        timer.lap('record')
+
+        # Same as self._all.update()
+        if self.scheduler is not None:
+            due = self.scheduler.due(self.shared.counter)
+            timer.each('update', due)
+            self.scheduler.done(due)
+        else:
+            timer.each('update', self._all.sprites())
+        timer.lap('update')
+
+        if self.batched_interactions and self.shared.counter % TIMESTEP_INTERVAL == 0:
+            resolve_interactions(self)
+            timer.lap('interactions')
+
+        if self.recorder is None:
+            if self.sink is not None:
+                self.sink.write(self._metrics._temporary_snapshots)
+                self._metrics._temporary_snapshots = defaultdict(list)
+            elif self.schema is not None:
+                chunk = self.schema.to_polars(self._metrics._temporary_snapshots, categorical=False)
+                self._metrics.snapshots.vstack(chunk, in_place=True)
+                self._metrics._temporary_snapshots = defaultdict(list)
+            else:
+                self._metrics._merge()
+        timer.lap('merge')
+
+        self.after_update()
+        timer.lap('after_update')
+
+        if self.config.duration > 0 and self.shared.counter == self.config.duration:
+            self.stop_reason = f'reached the duration of {self.config.duration} frames'
+            self.stop()
+            return
+
+        if self.shared.counter % self.stop_interval == 0:
+            reason = stop_reason(self.stop_conditions, self.shared.counter, self.populations)
+            timer.lap('stop_conditions')
+            if reason is not None:
+                self.stop_reason = reason
+                self.stop()
+                return
+
+        self.shared.counter += 1
+
+    def _resume(self):
+        if self._resume_random_state is not None:
+            random.setstate(self._resume_random_state)
+            self._resume_random_state = None
+
+    def advance(self, frames: int):
+        # Run a number of frames without finishing the run, e.g. a warm-up before taking a checkpoint
+        self._resume()
+        self._running = True
+        for _ in range(frames):
+            if not self._running:
+                break
+            self.tick()
+        return self
+
+    def run(self) -> SimulationMetrics:
+        self._resume()
+        metrics = super().run()
+        metrics.frames = self.frame_recorder.to_polars()
+        metrics.stop_reason = self.stop_reason
+        metrics.timings = self.timer.to_polars()
+        if self.sink is not None:
+            self.sink.close()
+        if self.recorder is not None:
+            metrics.snapshots = self.recorder.to_polars()
+        elif self.sink is None and self.schema is not None:
+            metrics.snapshots = self.schema.cast(metrics.snapshots)
+        return metrics
 
     def spawn_grass_patches(self, num_patches, min_distance, img_path):
         max_attempts = 100
@@ -63,12 +325,13 @@ class MySimulation(HeadlessSimulation):
         img = Image.open(img_path)
         img_width, img_height = img.size
 
+        rng = self.rng.stream(SIMULATION_ID, self.shared.counter, 'patches')
         self.patches = []
         for _ in range(num_patches):
             attempt = 0
             while attempt < max_attempts:
-                x = random.randint(min_distance + img_width / 2, self.config.window.width - min_distance - img_width / 2)
-                y = random.randint(min_distance + img_height / 2, self.config.window.width - min_distance - img_height / 2)
+                x = rng.randint(min_distance + img_width / 2, self.config.window.width - min_distance - img_width / 2)
+                y = rng.randint(min_distance + img_height / 2, self.config.window.width - min_distance - img_height / 2)
                 new_patch = Vector2(x, y)
 
                 if not any(overlap(new_patch, existing_patch, img) for existing_patch in self.patches):
@@ -80,8 +343,8 @@ class MySimulation(HeadlessSimulation):
         # for i, patch in enumerate(self.patches):
         #     self.spawn_site(img_path, patch.x, patch.y)
         for i, pos in enumerate(self.patches):
-            x, y = perturb_point_within_radius(pos.x, pos.y, GROW_RADIUS)
-            self.spawn_agent(self.grass_agent, ['images/grass_icon.png'], x, y)
+            x, y = perturb_point_within_radius(pos.x, pos.y, GROW_RADIUS, rng)
+            self.spawn_grass(x, y)
         
         return self
 
@@ -90,10 +353,18 @@ SEASON_LENGTH = 7200
 
 
 class MySeasonalSimulation(MySimulation):
-    def __init__(self, grass_agent, config: Config | None = None):
-        super().__init__(grass_agent, config)
+    def __init__(self, grass_agent, config: Config | None = None, recorder: Recorder | None = None,
+                 sink: SnapshotSink | None = None, grass_field: bool = False, schema: Schema | None = None,
+                 stop_conditions: list[StopCondition] | None = None, stop_interval: int = TIMESTEP_INTERVAL,
+                 counter_rng: bool = False, timer: PhaseTimer | None = None, pool: AgentPool | None = None,
+                 batched_interactions: bool = False, scheduled_updates: bool = False):
+        super().__init__(grass_agent, config, recorder, sink, grass_field, schema, stop_conditions, stop_interval,
+                         counter_rng, timer, pool, batched_interactions, scheduled_updates)
         self.seasons = {'spring': GROW_RATE / 1.75, 'summer': GROW_RATE, 'autumn': GROW_RATE / 2.25, 'winter': GROW_RATE / 3}
         self.season_idx = 0
+
+    def frame_data(self) -> dict:
+        return {**super().frame_data(), 'season': list(self.seasons.keys())[self.season_idx]}
     
     def before_update(self): 
         if self.shared.counter % SEASON_LENGTH == 0:
@@ -107,7 +378,7 @@ class MySeasonalSimulation(MySimulation):
         # self._screen.blit(text, (50, 50)) 
         super().after_update()
 
-    def run(self) -> Metrics:
+    def run(self) -> SimulationMetrics:
         pg.font.init()
         return super().run()
 
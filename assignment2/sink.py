@@ -0,0 +1,78 @@
+import glob
+import os
+from collections import defaultdict
+from typing import Any
+
+import polars as pl
+
+from common.recorder import Schema
+
+CHUNK_ROWS = 250_000
+
+
+class SnapshotSink:
+    # Writes snapshot rows to disk in chunks of `chunk_rows` while the simulation runs,
+    # so memory stays flat and finished chunks survive a killed process.
+    # Chunks already in the directory are only removed with overwrite, otherwise it's an error
+    def __init__(self, directory: str, chunk_rows: int = CHUNK_ROWS, file_format: str = 'parquet',
+                 schema: Schema | None = None, overwrite: bool = False):
+        if file_format not in ('parquet', 'ipc'):
+            raise ValueError(f"Unknown snapshot format '{file_format}', expected 'parquet' or 'ipc'")
+
+        self.directory = directory
+        self.chunk_rows = chunk_rows
+        self.file_format = file_format
+        self.schema = schema
+
+        self._buffer: defaultdict[str, list[Any]] = defaultdict(list)
+        self._chunks = 0
+
+        # Chunks of an earlier run would otherwise be scanned together with this one
+        os.makedirs(directory, exist_ok=True)
+        existing = glob.glob(self.pattern)
+        if existing and not overwrite:
+            raise FileExistsError(f"'{directory}' already holds {len(existing)} snapshot chunks, "
+                                  f"pass overwrite=True to replace them")
+        for path in existing:
+            os.remove(path)
+
+    @property
+    def pattern(self) -> str:
+        extension = 'parquet' if self.file_format == 'parquet' else 'arrow'
+        return os.path.join(self.directory, f'part-*.{extension}')
+
+    def write(self, snapshots: dict[str, list[Any]]):
+        for column, values in snapshots.items():
+            self._buffer[column].extend(values)
+
+        if len(self._buffer['frame']) >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer['frame']:
+            return
+
+        df = self.schema.to_polars(self._buffer) if self.schema is not None else pl.from_dict(self._buffer)
+        path = self.pattern.replace('*', f'{self._chunks:05d}')
+        if self.file_format == 'parquet':
+            df.write_parquet(path)
+        else:
+            df.write_ipc(path)
+
+        self._buffer = defaultdict(list)
+        self._chunks += 1
+
+    def close(self):
+        self.flush()
+
+    def scan(self) -> pl.LazyFrame:
+        read = pl.scan_parquet if self.file_format == 'parquet' else pl.scan_ipc
+        categorical = self.schema.categorical_columns() if self.schema is not None else []
+        paths = sorted(glob.glob(self.pattern))
+        if not categorical or not paths:
+            return read(self.pattern)
+
+        # Every chunk has categories of its own, they're stacked as strings and made categorical again
+        # afterwards, so reading them back doesn't need a global string cache
+        chunks = [read(path).with_columns([pl.col(column).cast(pl.Utf8) for column in categorical]) for path in paths]
+        return pl.concat(chunks).with_columns([pl.col(column).cast(pl.Categorical) for column in categorical])
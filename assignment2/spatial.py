@@ -0,0 +1,128 @@
+from collections import defaultdict
+from typing import Type
+
+import numpy as np
+from pygame.sprite import Group
+from vi import Agent
+from vi.proximity import ProximityEngine, ProximityIter
+
+
+class TypedProximityEngine(ProximityEngine):
+    # Uniform grid with a separate set of buckets for every agent class,
+    # so a query for one kind never touches the agents of another kind
+    def __init__(self, agents: Group, radius: int):
+        self._members = agents
+        self._buckets: dict[type, defaultdict[tuple[int, int], list[Agent]]] = {}
+
+        # Asleep agents don't move, they're put in these buckets once instead of on every update
+        self._static: dict[type, defaultdict[tuple[int, int], list[Agent]]] = {}
+        super().__init__(agents, radius)
+
+    def _set_radius(self, radius: int):
+        rebucket = self._static and radius != self.chunk_size
+        self.radius = radius
+        self.chunk_size = radius
+
+        if rebucket:
+            static = [agent for cells in self._static.values() for members in cells.values() for agent in members]
+            self._static = {}
+            for agent in static:
+                self.add_static(agent)
+
+    def _cell(self, x: float, y: float) -> tuple[int, int]:
+        return (int(x // self.chunk_size), int(y // self.chunk_size))
+
+    @staticmethod
+    def _insert(buckets: dict, agent: Agent, cell: tuple[int, int]):
+        cells = buckets.get(type(agent))
+        if cells is None:
+            cells = buckets[type(agent)] = defaultdict(list)
+        cells[cell].append(agent)
+
+    def update(self, agents: list[Agent] | None = None):
+        # Only the given agents (the awake ones) are indexed again
+        self._buckets = {}
+        for agent in self._members.sprites() if agents is None else agents:
+            self._insert(self._buckets, agent, self._cell(agent.pos.x, agent.pos.y))
+
+    def add(self, agent: Agent):
+        # Into the grid of this tick, e.g. an agent that just woke up
+        self._insert(self._buckets, agent, self._cell(agent.pos.x, agent.pos.y))
+
+    def add_static(self, agent: Agent):
+        self._insert(self._static, agent, self._cell(agent.pos.x, agent.pos.y))
+
+    def remove_static(self, agent: Agent):
+        self._static[type(agent)][self._cell(agent.pos.x, agent.pos.y)].remove(agent)
+
+    def kinds(self, kind: Type[Agent]) -> list[type]:
+        # Every indexed class that counts as the requested kind (subclasses included)
+        return [cls for cls in {**self._buckets, **self._static} if issubclass(cls, kind)]
+
+    def in_proximity_of(self, agent: Agent, kind: Type[Agent], radius: float | None = None) -> list[tuple[Agent, float]]:
+        if not agent.alive():
+            return []
+
+        radius = self.radius if radius is None else radius
+        pos = agent.pos
+        min_x, min_y = self._cell(pos.x - radius, pos.y - radius)
+        max_x, max_y = self._cell(pos.x + radius, pos.y + radius)
+
+        neighbours = []
+        for cls in self.kinds(kind):
+            for buckets in (self._buckets, self._static):
+                cells = buckets.get(cls)
+                if cells is None:
+                    continue
+                for x in range(min_x, max_x + 1):
+                    for y in range(min_y, max_y + 1):
+                        for other in cells.get((x, y), ()):
+                            if other is agent or not other.alive():
+                                continue
+                            distance = pos.distance_to(other.pos)
+                            if distance <= radius:
+                                neighbours.append((other, distance))
+
+        return neighbours
+
+    def in_proximity_accuracy(self, agent: Agent) -> ProximityIter[tuple[Agent, float]]:
+        return ProximityIter(iter(self.in_proximity_of(agent, Agent)))
+
+    def in_proximity_performance(self, agent: Agent) -> ProximityIter[Agent]:
+        return ProximityIter(other for other, _ in self.in_proximity_of(agent, Agent))
+
+
+def pairs_within(a: np.ndarray, b: np.ndarray, distance: float,
+                 inclusive: bool = True) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Every (i, j) with a[i] and b[j] within `distance` (or closer than it with inclusive=False),
+    # as one pass over a grid of distance-sized cells. Returns the indices and the distances
+    empty = np.zeros(0, dtype=np.int64)
+    if len(a) == 0 or len(b) == 0:
+        return empty, empty, np.zeros(0)
+
+    cells_a = np.floor(a / distance).astype(np.int64)
+    cells_b = np.floor(b / distance).astype(np.int64)
+
+    # One key per cell, with a margin so the neighbouring cells of a never wrap onto another row
+    low = np.minimum(cells_a.min(axis=0), cells_b.min(axis=0)) - 1
+    span = np.maximum(cells_a.max(axis=0), cells_b.max(axis=0)) - low + 2
+    keys_b = (cells_b[:, 0] - low[0]) * span[1] + (cells_b[:, 1] - low[1])
+    order = np.argsort(keys_b, kind='stable')
+    sorted_keys = keys_b[order]
+
+    found_a, found_b = [], []
+    for ox in (-1, 0, 1):
+        for oy in (-1, 0, 1):
+            keys = (cells_a[:, 0] + ox - low[0]) * span[1] + (cells_a[:, 1] + oy - low[1])
+            starts = np.searchsorted(sorted_keys, keys, side='left')
+            lengths = np.searchsorted(sorted_keys, keys, side='right') - starts
+
+            i = np.repeat(np.arange(len(a)), lengths)
+            offsets = np.arange(len(i)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            found_a.append(i)
+            found_b.append(order[np.repeat(starts, lengths) + offsets])
+
+    i, j = np.concatenate(found_a), np.concatenate(found_b)
+    distances = np.hypot(*(a[i] - b[j]).T)
+    keep = distances <= distance if inclusive else distances < distance
+    return i[keep], j[keep], distances[keep]
@@ -0,0 +1,225 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+# Run from the repository root (image paths are relative to it):
+#   python benchmark.py                       all models at 100, 1000 and 10000 agents
+#   python benchmark.py --models flocking --sizes 100 1000 --output before.json
+#   python benchmark.py --compare before.json after.json
+
+MODELS = ['flocking', 'flocking-grid', 'aggregation', 'aggregation-batched', 'predator-prey']
+SIZES = [100, 1000, 10000]
+SEED = 1
+
+# Fewer ticks for bigger populations, so every run takes roughly the same time
+TICK_BUDGET = 50_000
+MIN_TICKS = 10
+MAX_TICKS = 500
+
+
+def default_ticks(agents: int) -> int:
+    return max(MIN_TICKS, min(MAX_TICKS, TICK_BUDGET // agents))
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kB on Linux and in bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+
+def timed_ticks(simulation, ticks: int) -> tuple[float, int]:
+    # Ticks a vi simulation by hand, counting the agents alive at the start of every tick
+    simulation._running = True
+    updates = 0
+    start = time.perf_counter()
+    for _ in range(ticks):
+        updates += len(simulation._agents)
+        simulation.tick()
+    return time.perf_counter() - start, updates
+
+
+def bench_flocking(agents: int, ticks: int, seed: int, approximate: bool = False) -> tuple[float, int, int]:
+    os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+    sys.path.insert(0, 'assignment0')
+    from flocking import Bird, FlockingConfig, FlockingLive
+
+    config = FlockingConfig(image_rotation=True, movement_speed=1.0, radius=75, seed=seed, fps_limit=0,
+                            approximate=approximate)
+    simulation = FlockingLive(config).batch_spawn_agents(agents, Bird, images=['images/bird.png'])
+
+    # FlockingLive prints the weights whenever they change
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        seconds, updates = timed_ticks(simulation, ticks)
+
+    return seconds, updates, int(simulation._metrics.snapshots.estimated_size())
+
+
+def bench_flocking_grid(agents: int, ticks: int, seed: int) -> tuple[float, int, int]:
+    return bench_flocking(agents, ticks, seed, approximate=True)
+
+
+def aggregation_scenario(agents: int, seed: int):
+    import dataclasses
+    import aggregation
+
+    scenario = aggregation.SCENARIOS[1]
+    return dataclasses.replace(scenario, agents=agents, config=dataclasses.replace(scenario.config, seed=seed, duration=0))
+
+
+def bench_aggregation(agents: int, ticks: int, seed: int) -> tuple[float, int, int]:
+    sys.path.insert(0, 'assignment1')
+    from aggregation import AggregationSimulation, Cockroach
+
+    scenario = aggregation_scenario(agents, seed)
+    simulation = AggregationSimulation(scenario.config)
+    for site_x, site_y in scenario.sites:
+        simulation.spawn_circle_site(site_x, site_y, scenario.site_size / 2)
+    simulation.batch_spawn_agents(scenario.agents, Cockroach, scenario.images)
+
+    seconds, updates = timed_ticks(simulation, ticks)
+    return seconds, updates, int(simulation.counts().estimated_size())
+
+
+def bench_aggregation_batched(agents: int, ticks: int, seed: int) -> tuple[float, int, int]:
+    sys.path.insert(0, 'assignment1')
+    from aggregation import CHECK_INTERVAL
+    from engine import AggregationEngine
+    from sites import CircleSites
+
+    scenario = aggregation_scenario(agents, seed)
+    sites = CircleSites()
+    for site_x, site_y in scenario.sites:
+        sites.add(site_x, site_y, scenario.site_size / 2)
+
+    width, height = scenario.config.window.as_tuple()
+    engine = AggregationEngine(agents, sites, width, height, scenario.config.movement_speed, scenario.config.radius,
+                               CHECK_INTERVAL, CHECK_INTERVAL, seed)
+
+    start = time.perf_counter()
+    for _ in range(ticks):
+        engine.tick()
+    seconds = time.perf_counter() - start
+
+    return seconds, agents * ticks, int(engine.counts().estimated_size())
+
+
+def bench_predator_prey(agents: int, ticks: int, seed: int) -> tuple[float, int, int]:
+    sys.path.insert(0, 'assignment2')
+    from main import build_simulation
+
+    # Same 20:150 predator to prey ratio as main.py, Grass agents grow on top of that
+    predators = max(1, agents * 20 // 170)
+    simulation = build_simulation(seed, 0, seasonal=True, predators=predators, prey=agents - predators)
+
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        seconds, updates = timed_ticks(simulation, ticks)
+
+    size = simulation.recorder.to_polars().estimated_size() + simulation.frame_recorder.to_polars().estimated_size()
+    return seconds, updates, int(size)
+
+
+BENCHMARKS = {
+    'flocking': bench_flocking,
+    'flocking-grid': bench_flocking_grid,
+    'aggregation': bench_aggregation,
+    'aggregation-batched': bench_aggregation_batched,
+    'predator-prey': bench_predator_prey,
+}
+
+
+def run_one(model: str, agents: int, ticks: int, seed: int) -> dict:
+    seconds, updates, metrics_bytes = BENCHMARKS[model](agents, ticks, seed)
+    return {
+        'model': model,
+        'agents': agents,
+        'ticks': ticks,
+        'seconds': seconds,
+        'ticks_per_sec': ticks / seconds,
+        'agent_updates_per_sec': updates / seconds,
+        'peak_rss_mb': peak_rss_mb(),
+        'metrics_bytes': metrics_bytes,
+    }
+
+
+def run_isolated(model: str, agents: int, ticks: int, seed: int) -> dict:
+    # One process per run, so peak RSS belongs to that run alone
+    # (and the assignments' modules with the same names don't clash)
+    command = [sys.executable, __file__, '--child', model, str(agents), str(ticks), str(seed)]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def git_commit() -> str | None:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], check=True, capture_output=True,
+                              text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_result(result: dict):
+    print(f"{result['model']:>20} {result['agents']:>6} agents: {result['ticks_per_sec']:9.1f} ticks/s "
+          f"{result['agent_updates_per_sec']:12.0f} updates/s {result['peak_rss_mb']:8.1f} MB peak "
+          f"{result['metrics_bytes'] / 1024:10.1f} kB metrics")
+
+
+def compare(before_path: str, after_path: str):
+    with open(before_path) as file:
+        before = {(r['model'], r['agents']): r for r in json.load(file)['results']}
+    with open(after_path) as file:
+        after = json.load(file)['results']
+
+    for result in after:
+        old = before.get((result['model'], result['agents']))
+        if old is None:
+            continue
+        speedup = result['agent_updates_per_sec'] / old['agent_updates_per_sec']
+        memory = result['peak_rss_mb'] / old['peak_rss_mb']
+        print(f"{result['model']:>20} {result['agents']:>6} agents: {speedup:6.2f}x updates/s, {memory:6.2f}x peak RSS")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Throughput of the flocking, aggregation and predator-prey models')
+    parser.add_argument('--models', nargs='+', choices=MODELS, default=MODELS)
+    parser.add_argument('--sizes', nargs='+', type=int, default=SIZES)
+    parser.add_argument('--ticks', type=int, default=None, help='ticks per run (default: scaled to the agent count)')
+    parser.add_argument('--seed', type=int, default=SEED)
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'))
+    parser.add_argument('--child', nargs=4, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        model, agents, ticks, seed = args.child
+        print(json.dumps(run_one(model, int(agents), int(ticks), int(seed))))
+        return
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    results = []
+    for model in args.models:
+        for agents in args.sizes:
+            result = run_isolated(model, agents, args.ticks or default_ticks(agents), args.seed)
+            print_result(result)
+            results.append(result)
+
+    with open(args.output, 'w') as file:
+        json.dump({
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'results': results,
+        }, file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any
+
+import polars as pl
+
+
+@dataclass
+class Schema:
+    # Declared dtypes for recorded columns, and replay columns to leave out at record time
+    dtypes: dict[str, Any] = field(default_factory=dict)
+    exclude: tuple[str, ...] = ()
+
+    def categorical_columns(self) -> list[str]:
+        return [column for column, dtype in self.dtypes.items() if dtype == pl.Categorical]
+
+    def keeps(self, column: str) -> bool:
+        return column not in self.exclude
+
+    def cast(self, df: pl.DataFrame, categorical: bool = True) -> pl.DataFrame:
+        # Without `categorical`, Categorical columns are left as strings: chunks with categories of their own can
+        # only be stacked on top of each other under one string cache, so they're made categorical once stacked
+        dtypes = {column: dtype if categorical or dtype != pl.Categorical else pl.Utf8
+                  for column, dtype in self.dtypes.items() if column in df.columns}
+        return df.with_columns([pl.col(column).cast(dtype) for column, dtype in dtypes.items()])
+
+    def to_polars(self, snapshots: dict[str, list[Any]], categorical: bool = True) -> pl.DataFrame:
+        return self.cast(pl.from_dict(snapshots), categorical)
+
+
+class Recorder:
+    # Keeps running counts per (frame, *keys) every `interval` frames (in frame order),
+    # instead of a snapshot row per agent per frame. The key columns are cast to the schema's dtypes
+    def __init__(self, interval: int = 1, keys: tuple[str, ...] = (), schema: Schema | None = None):
+        self.interval = interval
+        self.keys = keys
+        self.schema = schema
+        self._counts: Counter[tuple[Any, ...]] = Counter()
+
+    def should_record(self, frame: int) -> bool:
+        return frame % self.interval == 0
+
+    def record(self, frame: int, count: int = 1, **values: Any):
+        self._counts[(frame, *(values.get(key) for key in self.keys))] += count
+
+    def to_polars(self) -> pl.DataFrame:
+        columns = ['frame', *self.keys]
+        rows = list(zip(*self._counts.keys())) if self._counts else [[] for _ in columns]
+
+        df = pl.DataFrame({column: list(values) for column, values in zip(columns, rows)})
+        df = df.with_columns(pl.Series('count', list(self._counts.values()), dtype=pl.UInt32))
+        df = df.with_columns(pl.col('frame').cast(pl.Int64))
+        return df if self.schema is None else self.schema.cast(df)
@@ -0,0 +1,32 @@
+from collections import defaultdict
+
+from vi import Agent
+
+
+class Scheduler:
+    # Agents bucketed by the tick their update() next does anything, so they're only called on those ticks.
+    # Agents say when that is with next_update(tick): the first tick after `tick` they act on.
+    # Waking an agent too early is harmless (update() still checks its own intervals), missing a tick isn't
+    def __init__(self, now: int = -1):
+        # Last tick whose agents were handed out, agents added during it wait for a later one
+        self.now = now
+        self._buckets: defaultdict[int, list[tuple[int, Agent]]] = defaultdict(list)
+
+    def __len__(self) -> int:
+        return sum(len(bucket) for bucket in self._buckets.values())
+
+    def add(self, agent: Agent):
+        self._buckets[agent.next_update(self.now)].append((agent.id, agent))
+
+    def due(self, tick: int) -> list[Agent]:
+        # Agents to update on this tick, in the order they were spawned (like the sprite group).
+        # Entries of agents that died since (or were reused from a pool under a new id) are dropped
+        self.now = tick
+        bucket = self._buckets.pop(tick, [])
+        bucket.sort(key=lambda entry: entry[0])
+        return [agent for agent_id, agent in bucket if agent.id == agent_id and agent.alive()]
+
+    def done(self, agents: list[Agent]):
+        for agent in agents:
+            if agent.alive():
+                self.add(agent)
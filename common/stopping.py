@@ -0,0 +1,69 @@
+from abc import ABC, abstractmethod
+from collections import deque
+from typing import Callable, Iterable
+
+
+class StopCondition(ABC):
+    # Looks at the populations (per species, or per state and site) every time the simulation checks,
+    # returns why the run should stop or None to keep going
+    @abstractmethod
+    def check(self, frame: int, populations: dict[str, int]) -> str | None:
+        ...
+
+
+class Extinction(StopCondition):
+    # Stop once any of the populations is empty
+    def __init__(self, keys: Iterable[str]):
+        self.keys = tuple(keys)
+
+    def check(self, frame: int, populations: dict[str, int]) -> str | None:
+        for key in self.keys:
+            if populations.get(key, 0) == 0:
+                return f'no {key} left on frame {frame}'
+        return None
+
+
+class PopulationBand(StopCondition):
+    # Stop once every population stayed within a band of `width` for the last `samples` checks
+    def __init__(self, keys: Iterable[str], width: int, samples: int):
+        self.keys = tuple(keys)
+        self.width = width
+        self._history: deque[tuple[int, ...]] = deque(maxlen=samples)
+
+    def check(self, frame: int, populations: dict[str, int]) -> str | None:
+        self._history.append(tuple(populations.get(key, 0) for key in self.keys))
+        if len(self._history) < self._history.maxlen:
+            return None
+
+        for values in zip(*self._history):
+            if max(values) - min(values) > self.width:
+                return None
+
+        return f'{", ".join(self.keys)} stayed within {self.width} for {len(self._history)} samples on frame {frame}'
+
+
+class MaxAgents(StopCondition):
+    # Stop runaway growth once there are more than `limit` agents (of the given populations, or in total)
+    def __init__(self, limit: int, keys: Iterable[str] | None = None):
+        self.limit = limit
+        self.keys = None if keys is None else tuple(keys)
+
+    def check(self, frame: int, populations: dict[str, int]) -> str | None:
+        keys = populations.keys() if self.keys is None else self.keys
+        total = sum(populations.get(key, 0) for key in keys)
+        if total > self.limit:
+            return f'{total} agents on frame {frame}, more than the limit of {self.limit}'
+        return None
+
+
+def stop_reason(conditions: list[StopCondition], frame: int, populations: Callable[[], dict[str, int]]) -> str | None:
+    # Populations are only counted when there's a condition to check
+    if not conditions:
+        return None
+
+    counts = populations()
+    for condition in conditions:
+        reason = condition.check(frame, counts)
+        if reason is not None:
+            return reason
+    return None
@@ -0,0 +1,103 @@
+import math
+import random
+import zlib
+
+import numpy as np
+from pygame.math import Vector2
+
+MASK = (1 << 64) - 1
+GAMMA = 0x9E3779B97F4A7C15
+TO_UNIT = 1.0 / (1 << 53)
+
+
+def _mix(x: int) -> int:
+    # splitmix64 finalizer on python ints
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK
+    return x ^ (x >> 31)
+
+
+def _mix_array(x: np.ndarray) -> np.ndarray:
+    # Same as _mix, uint64 arithmetic wraps around like the & MASK above
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+_purposes: dict[str, int] = {}
+
+
+def purpose_code(purpose: str) -> int:
+    # Stable between processes, unlike hash()
+    if purpose not in _purposes:
+        _purposes[purpose] = zlib.crc32(purpose.encode())
+    return _purposes[purpose]
+
+
+class GlobalRandom:
+    # The original behaviour: every draw comes from the global random module, in update order
+    def stream(self, agent_id: int, tick: int, purpose: str):
+        return random
+
+    def draws(self, agent_ids: np.ndarray, tick: int, purpose: str, count: int = 1) -> np.ndarray:
+        # In the order of agent_ids
+        return np.array([[random.random() for _ in range(count)] for _ in agent_ids]).reshape(len(agent_ids), count)
+
+    def place(self, agent):
+        # vi picks the spawn position and direction itself
+        pass
+
+
+class Stream:
+    # Draws for one (agent, tick, purpose), the n-th call uses index n
+    def __init__(self, key: int):
+        self._key = key
+        self._index = 0
+
+    def random(self) -> float:
+        value = _mix(((self._key + GAMMA) & MASK) ^ self._index)
+        self._index += 1
+        return (value >> 11) * TO_UNIT
+
+    def uniform(self, a: float, b: float) -> float:
+        return a + (b - a) * self.random()
+
+    def randint(self, a: int, b: int) -> int:
+        a, b = int(a), int(b)
+        return a + int(self.random() * (b - a + 1))
+
+
+class CounterRandom:
+    # Counter-based draws: a number only depends on (seed, agent id, tick, purpose, index),
+    # so it's the same whether agents update one at a time, in another order, batched or in another process
+    def __init__(self, seed: int | None = None):
+        self.seed = random.getrandbits(64) if seed is None else seed & MASK
+
+    def key(self, agent_id: int, tick: int, purpose: str) -> int:
+        key = self.seed
+        for part in (agent_id, tick, purpose_code(purpose)):
+            key = _mix(((key + GAMMA) & MASK) ^ (part & MASK))
+        return key
+
+    def stream(self, agent_id: int, tick: int, purpose: str) -> Stream:
+        return Stream(self.key(agent_id, tick, purpose))
+
+    def draws(self, agent_ids: np.ndarray, tick: int, purpose: str, count: int = 1) -> np.ndarray:
+        # (agents x count) batch, column n holds what the n-th call of each agent's stream returns
+        key = np.full(len(agent_ids), self.seed, dtype=np.uint64)
+        for part in (np.asarray(agent_ids, dtype=np.int64).astype(np.uint64),
+                     np.uint64(tick & MASK), np.uint64(purpose_code(purpose))):
+            key = _mix_array((key + np.uint64(GAMMA)) ^ part)
+
+        index = np.arange(count, dtype=np.uint64)
+        values = _mix_array((key[:, None] + np.uint64(GAMMA)) ^ index[None, :])
+        return (values >> np.uint64(11)).astype(np.float64) * TO_UNIT
+
+    def place(self, agent):
+        # Spawn position and direction from the agent's own stream instead of vi's shared generator
+        stream = self.stream(agent.id, agent.shared.counter, 'spawn')
+        area = agent._area
+        agent.pos = Vector2(stream.uniform(area.left, area.right), stream.uniform(area.top, area.bottom))
+
+        angle = stream.uniform(0, 2 * math.pi)
+        agent.move = Vector2(math.cos(angle), math.sin(angle)) * agent.config.movement_speed
@@ -0,0 +1,11 @@
+import numpy as np
+
+# Keeps the (block x agents) distance matrices of the engines at a few MB
+BLOCK_ELEMENTS = 1 << 21
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    # Same arithmetic as Vector2.normalize per row, so both paths round the same way,
+    # but zero vectors stay zero instead of raising
+    lengths = np.sqrt(vectors[:, 0] * vectors[:, 0] + vectors[:, 1] * vectors[:, 1])[:, None]
+    return np.divide(vectors, lengths, out=np.zeros_like(vectors), where=lengths > 0)
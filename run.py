@@ -0,0 +1,24 @@
+import os
+import runpy
+import sys
+
+# Runs an assignment script with the repository root on sys.path, so it can import the modules the assignments
+# share (common/). Run from the repository root (image paths are relative to it):
+#   python run.py assignment0/flocking.py
+#   python run.py assignment2/search.py 64
+
+
+def main():
+    if len(sys.argv) < 2:
+        sys.exit('usage: python run.py <assignment script> [arguments...]')
+
+    # Like `python <script>`, the script's own directory comes first. The root is already on sys.path,
+    # it's the directory of run.py
+    script = sys.argv[1]
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script)))
+    sys.argv = sys.argv[1:]
+    runpy.run_path(script, run_name='__main__')
+
+
+if __name__ == '__main__':
+    main()